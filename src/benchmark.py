@@ -0,0 +1,235 @@
+"""
+Latency and throughput benchmarks for the vision and input hot paths.
+
+    python benchmark.py [--recording session.rec] [--iterations 200] [--output bench.json] [--only color]
+
+Frames come from a recording (see frame_source.py) or are synthetic. Templates are always synthetic crops of the
+first frame, so every check has something to find. Results are written as json to diff them between commits.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import cv2
+from loguru import logger
+
+from config import Config
+from screen import Screen
+from frame_source import ReplayFrameSource
+from frame_buffer import FrameRing
+from ui_control import ScreenObject, ScreenObjects
+import template_finder
+from template_finder import TemplateRegistry, color_filter, _single_template_match, detect_screen_object, find_all
+from template_store import build_store
+from screen_state import ScreenState
+
+TEMPLATE_SIZE = (24, 48)
+ROI_MARGIN = 40
+
+
+def measure(fn, iterations: int, warmup: int = 3) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = np.empty(iterations)
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples[i] = time.perf_counter() - start
+    return {
+        "iterations": iterations,
+        "mean_ms": float(samples.mean() * 1000),
+        "p50_ms": float(np.percentile(samples, 50) * 1000),
+        "p99_ms": float(np.percentile(samples, 99) * 1000),
+        "throughput_per_s": float(iterations / samples.sum()),
+    }
+
+
+def synthetic_frames(count: int = 8) -> list[np.ndarray]:
+    rng = np.random.default_rng(0)
+    h, w = Config.ui['window_height'], Config.ui['window_width']
+    return [cv2.GaussianBlur(rng.integers(0, 256, (h, w, 3), dtype=np.uint8), (7, 7), 0) for _ in range(count)]
+
+
+def recorded_frames(path: str) -> list[np.ndarray]:
+    source = ReplayFrameSource(path, realtime=False)
+    return [source.frame(i).copy() for i in range(len(source))]
+
+
+def frame_cycle(frames: list[np.ndarray]):
+    # tag frames like Screen does, so per-frame caches behave as they would live
+    seq = 0
+
+    def next_frame():
+        nonlocal seq
+        seq += 1
+        return FrameRing.publish(frames[seq % len(frames)], seq)
+
+    return next_frame
+
+
+def write_templates(frame: np.ndarray, folder: str) -> dict[str, list]:
+    """
+    Write a crop of frame as template png for every template name used by ScreenObjects.
+    :return: Template name -> [x, y, w, h] it was cropped from.
+    """
+    rng = random.Random(0)
+    th, tw = TEMPLATE_SIZE
+    regions = {}
+    names = {n for obj in vars(ScreenObjects).values() if isinstance(obj, ScreenObject) for n in obj.name}
+    for i, name in enumerate(sorted(names)):
+        x = rng.randrange(ROI_MARGIN, frame.shape[1] - tw - ROI_MARGIN)
+        y = rng.randrange(ROI_MARGIN, frame.shape[0] - th - ROI_MARGIN)
+        img = cv2.cvtColor(np.ascontiguousarray(frame[y:y + th, x:x + tw]), cv2.COLOR_BGR2BGRA)
+        if i % 2:
+            # every other template is transparent at the corners to exercise masked matching
+            img[:4, :4, 3] = 0
+        cv2.imwrite(os.path.join(folder, f"{name.lower()}.png"), img)
+        regions[name] = [x, y, tw, th]
+    return regions
+
+
+def synthetic_rois(regions: dict[str, list]) -> dict[str, list]:
+    """
+    Rois for all ScreenObject.roi_name missing in Config.ui_roi, placed around the object's first template.
+    """
+    rois = {}
+    for obj in vars(ScreenObjects).values():
+        if isinstance(obj, ScreenObject) and obj.roi_name and obj.roi_name not in Config.ui_roi:
+            x, y, w, h = regions[obj.name[0]]
+            rois[obj.roi_name] = [x - ROI_MARGIN, y - ROI_MARGIN, w + 2 * ROI_MARGIN, h + 2 * ROI_MARGIN]
+    return rois
+
+
+def bench_store(folder: str, iterations: int) -> dict:
+    results = {}
+    store_path = os.path.join(folder, "bench.store")
+    results["stored_templates_build"] = measure(lambda: build_store([folder], store_path), max(1, iterations // 20), 1)
+
+    def cold_load():
+        registry = TemplateRegistry([folder], Config.templates['memory_budget_mb'] * 1024 * 1024, store_path)
+        for key in registry.keys():
+            registry.get(key, ("img_bgr", "img_gray", "alpha_mask"))
+
+    results["stored_templates_cold_load"] = measure(cold_load, max(1, iterations // 10), 1)
+    return results
+
+
+def bench_matching(next_frame, registry: TemplateRegistry, regions: dict[str, list], iterations: int) -> dict:
+    results = {}
+    masked = next(k for k in registry.keys() if registry.variant(k, "alpha_mask") is not None)
+    plain = next(k for k in registry.keys() if registry.variant(k, "alpha_mask") is None)
+    red = Config.colors["red"]
+
+    def roi(key):
+        x, y, w, h = regions[key]
+        return [x - ROI_MARGIN, y - ROI_MARGIN, w + 2 * ROI_MARGIN, h + 2 * ROI_MARGIN]
+
+    cases = {
+        "match_gray": (plain, dict(use_grayscale=True)),
+        "match_bgr": (plain, dict()),
+        "match_color": (plain, dict(color_match=red)),
+        "match_masked": (masked, dict()),
+    }
+    for name, (key, kwargs) in cases.items():
+        template = registry.get(key)
+        results[name] = measure(lambda: _single_template_match(template, next_frame(), roi(key), **kwargs), iterations)
+        results[name + "_full_frame"] = measure(
+            lambda: _single_template_match(template, next_frame(), None, **kwargs), max(1, iterations // 10))
+        results[name + "_full_frame_pyramid"] = measure(
+            lambda: _single_template_match(template, next_frame(), None, use_pyramid=True, **kwargs),
+            max(1, iterations // 10))
+
+    results["find_all"] = measure(lambda: find_all(plain, next_frame(), roi=roi(plain)), iterations)
+    results["color_filter"] = measure(lambda: color_filter(next_frame(), red), iterations)
+    return results
+
+
+def bench_sweep(next_frame, iterations: int) -> dict:
+    objects = [obj for obj in vars(ScreenObjects).values() if isinstance(obj, ScreenObject)]
+
+    def sweep():
+        frame = next_frame()
+        for obj in objects:
+            detect_screen_object(obj, frame)
+
+    state = ScreenState(objects)
+    return {
+        "screen_objects_sweep": measure(sweep, max(1, iterations // 10)),
+        "screen_state_classify": measure(lambda: state.classify(next_frame()), max(1, iterations // 10)),
+    }
+
+
+def bench_mouse(iterations: int) -> dict:
+    try:
+        from mouse_control import HumanCurve
+    except ImportError as e:
+        logger.warning(f"Skipping mouse benchmarks: {e}")
+        return {}
+    return {
+        "human_curve_short": measure(lambda: HumanCurve((600, 300), (700, 380), targetPoints=3), iterations),
+        "human_curve_cross_screen": measure(lambda: HumanCurve((10, 10), (1270, 710), targetPoints=6), iterations),
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(iterations: int, recording: str = None, only: str = None) -> dict:
+    frames = recorded_frames(recording) if recording else synthetic_frames()
+    next_frame = frame_cycle(frames)
+    if Screen.monitor["left"] is None:
+        # no game window, report matches in window coordinates
+        Screen.monitor["left"], Screen.monitor["top"] = 0, 0
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        regions = write_templates(frames[0], folder)
+        Config.ui_roi = {**Config.ui_roi, **synthetic_rois(regions)}
+        registry = TemplateRegistry([folder], Config.templates['memory_budget_mb'] * 1024 * 1024,
+                                    os.path.join(folder, "bench.store"))
+        # route named template lookups of template_finder to the synthetic templates
+        template_finder.stored_templates = lambda: registry
+
+        results.update(bench_store(folder, iterations))
+        results.update(bench_matching(next_frame, registry, regions, iterations))
+        results.update(bench_sweep(next_frame, iterations))
+        results.update(bench_mouse(iterations))
+        # the memory-mapped store has to be released before the folder can be removed on Windows
+        registry._store = None
+    if only:
+        results = {k: v for k, v in results.items() if only in k}
+    return {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "python": sys.version.split()[0],
+        "opencv": cv2.__version__,
+        "frames": "recording" if recording else "synthetic",
+        "results": results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recording", help="frame recording to benchmark on instead of synthetic frames")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--output", help="json file to write the results to")
+    parser.add_argument("--only", help="only report benchmarks whose name contains this")
+    args = parser.parse_args()
+
+    report = run(args.iterations, args.recording, args.only)
+    for name, r in report["results"].items():
+        print(f"{name:40s} p50 {r['p50_ms']:8.3f} ms  p99 {r['p99_ms']:8.3f} ms  {r['throughput_per_s']:9.1f}/s")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -11,6 +11,11 @@ class Config:
     game = {
         'path': r'C:\Program Files (x86)\Diablo II Resurrected',
         'window_process': r'D2R.exe',
+        # while the game window is not found, the search interval doubles from min to max seconds
+        'discovery_min_interval': 0.5,
+        'discovery_max_interval': 8,
+        # seconds between two position updates of the found window
+        'window_track_interval': 1,
     }
 
     bot = {
@@ -42,9 +47,42 @@ class Config:
         'tab_text': (0, 0, 125, 180, 255, 255),
     }
 
+    supervisor = {
+        # frames per second captured in total, shared between all game windows on this host
+        'capture_fps_budget': 60,
+        # seconds between two searches for started or closed game windows
+        'discovery_interval': 5,
+    }
+
+    input = {
+        # cursor positions per second when moving between two points of a curve
+        'step_rate': 120,
+        # the last seconds before an input event are busy waited instead of slept
+        'spin_threshold': 0.002,
+    }
+
+    templates = {
+        # upper bound for template images resized to the ui scale and kept in memory by each bot process
+        'memory_budget_mb': 64,
+    }
+
     ui = {
         'window_height': 720,
         'window_width': 1280,
+        # track which tiles of the frame changed between two grabs so unchanged regions can reuse detection results
+        'change_detection': False,
+        'change_tile_size': 80,
+        # number of preallocated capture buffers, a grabbed frame is overwritten after this many newer grabs
+        'capture_buffers': 4,
+        # ScreenState.detect checks every ScreenObject, regardless of its parents, every this many frames
+        'state_resync_frames': 25,
+        # seconds a recorded ScreenObject result is trusted by checks like mouse._is_clicking_safe before they match
+        # again themselves
+        'detection_max_age': 0.2,
+    }
+
+    # [x, y, w, h] regions in game window coordinates, referenced by ScreenObject.roi_name.
+    ui_roi = {
     }
 
     def __new__(cls, *args, **kwargs):
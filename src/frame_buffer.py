@@ -0,0 +1,45 @@
+import numpy as np
+
+
+class Frame(np.ndarray):
+    """
+    Read-only view of a capture buffer, tagged with the frame_seq of the grab that filled it. Caches are keyed on
+    the tag, so only the Frame returned by FrameRing.publish carries it: crops, copies and results derived from a
+    Frame are untagged (seq 0).
+    """
+    seq: int = 0
+
+    def __array_finalize__(self, obj):
+        self.seq = 0
+
+
+class FrameRing:
+    """
+    Fixed set of preallocated, contiguous BGR buffers that grabs are written into in turn, so capturing does not
+    allocate per frame. A published Frame stays valid until size - 1 further frames have been captured.
+    """
+
+    def __init__(self, size: int = 4):
+        self.size = max(2, size)
+        self.buffers = []
+        self.index = -1
+
+    def next_buffer(self, shape: tuple[int, ...]) -> np.ndarray:
+        if not self.buffers or self.buffers[0].shape != shape:
+            self.buffers = [np.empty(shape, dtype=np.uint8) for _ in range(self.size)]
+        self.index = (self.index + 1) % self.size
+        return self.buffers[self.index]
+
+    @staticmethod
+    def publish(buffer: np.ndarray, seq: int) -> Frame:
+        frame = buffer.view(Frame)
+        frame.seq = seq
+        frame.flags.writeable = False
+        return frame
+
+    def is_valid(self, frame: Frame, latest_seq: int) -> bool:
+        """
+        Check whether the buffer behind frame is not being reused by a newer grab yet. The grab after latest_seq
+        already writes into the buffer of frame latest_seq - size + 1.
+        """
+        return latest_seq - frame.seq < self.size - 1
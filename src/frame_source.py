@@ -0,0 +1,171 @@
+import time
+import struct
+import bisect
+import numpy as np
+import cv2
+from mss import mss
+from loguru import logger
+
+# recording format: magic, then for every frame a header (seconds since recording start, png length) and the png
+RECORDING_MAGIC = b"ABDREC01"
+FRAME_HEADER = struct.Struct("<dI")
+
+
+class FrameSource:
+    """
+    Where Screen.grab gets its screenshots from. grab returns a BGR image of the area described by monitor.
+    """
+    # whether the game window has to be located before grabbing
+    needs_window = True
+
+    def grab(self, monitor: dict) -> np.ndarray:
+        raise NotImplementedError
+
+    def frame_shape(self, monitor: dict) -> tuple[int, int, int]:
+        return monitor["height"], monitor["width"], 3
+
+    def grab_into(self, monitor: dict, out: np.ndarray):
+        """
+        Grab a frame directly into out, which has frame_shape(monitor).
+        """
+        np.copyto(out, self.grab(monitor))
+
+    def close(self):
+        pass
+
+
+class LiveFrameSource(FrameSource):
+    """
+    Captures the screen with mss.
+    """
+
+    def __init__(self):
+        self.sct = mss()
+
+    def grab(self, monitor: dict) -> np.ndarray:
+        return np.asarray(self.sct.grab(monitor))[:, :, :3]
+
+    def grab_into(self, monitor: dict, out: np.ndarray):
+        shot = self.sct.grab(monitor)
+        bgra = np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+        cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR, dst=out)
+
+
+class RecordingFrameSource(FrameSource):
+    """
+    Passes through the frames of another source and appends each of them to a recording file.
+    """
+
+    def __init__(self, source: FrameSource, path: str, png_compression: int = 1):
+        self.source = source
+        self.needs_window = source.needs_window
+        self.png_compression = png_compression
+        self.file = open(path, "wb")
+        self.file.write(RECORDING_MAGIC)
+        self.start_time = None
+
+    def frame_shape(self, monitor: dict) -> tuple[int, int, int]:
+        return self.source.frame_shape(monitor)
+
+    def grab_into(self, monitor: dict, out: np.ndarray):
+        self.source.grab_into(monitor, out)
+        self._record(out)
+
+    def grab(self, monitor: dict) -> np.ndarray:
+        image = self.source.grab(monitor)
+        self._record(image)
+        return image
+
+    def _record(self, image: np.ndarray):
+        now = time.perf_counter()
+        if self.start_time is None:
+            self.start_time = now
+        _, png = cv2.imencode(".png", image, [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression])
+        self.file.write(FRAME_HEADER.pack(now - self.start_time, len(png)))
+        self.file.write(png.tobytes())
+
+    def close(self):
+        self.file.close()
+        self.source.close()
+
+
+class ReplayFrameSource(FrameSource):
+    """
+    Feeds back the frames of a recording. With realtime, grab returns the frame that was current at the same time
+    after the first grab as during recording, otherwise every grab advances by one frame (maximum speed).
+    At the end of the recording, the last frame is returned again unless loop is set.
+    """
+    needs_window = False
+
+    def __init__(self, path: str, realtime: bool = True, loop: bool = False):
+        self.realtime = realtime
+        self.loop = loop
+        with open(path, "rb") as f:
+            self.data = f.read()
+        if not self.data.startswith(RECORDING_MAGIC):
+            raise ValueError(f"Not a frame recording: {path}")
+        self.timestamps = []
+        self.offsets = []
+        pos = len(RECORDING_MAGIC)
+        while pos + FRAME_HEADER.size <= len(self.data):
+            timestamp, length = FRAME_HEADER.unpack_from(self.data, pos)
+            pos += FRAME_HEADER.size
+            if pos + length > len(self.data):
+                logger.warning(f"Recording {path} is truncated after {len(self.offsets)} frames")
+                break
+            self.timestamps.append(timestamp)
+            self.offsets.append((pos, length))
+            pos += length
+        if not self.offsets:
+            raise ValueError(f"Recording contains no frames: {path}")
+        self.position = 0
+        self.start_time = None
+        self._decoded = (None, None)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @property
+    def exhausted(self) -> bool:
+        return not self.loop and self.position >= len(self.offsets)
+
+    def frame(self, i: int) -> np.ndarray:
+        if self._decoded[0] != i:
+            pos, length = self.offsets[i]
+            image = cv2.imdecode(np.frombuffer(self.data, np.uint8, length, pos), cv2.IMREAD_COLOR)
+            self._decoded = (i, image)
+        return self._decoded[1]
+
+    def frame_shape(self, monitor: dict) -> tuple[int, int, int]:
+        return self.frame(0).shape
+
+    def grab(self, monitor: dict) -> np.ndarray:
+        if self.realtime:
+            now = time.perf_counter()
+            if self.start_time is None:
+                self.start_time = now
+            elapsed = now - self.start_time
+            duration = self.timestamps[-1] - self.timestamps[0]
+            if self.loop and duration > 0:
+                elapsed %= duration
+            i = bisect.bisect_right(self.timestamps, self.timestamps[0] + elapsed) - 1
+            self.position = i + 1
+        else:
+            i = self.position % len(self.offsets) if self.loop else min(self.position, len(self.offsets) - 1)
+            self.position += 1
+        return self.frame(max(0, i))
+
+
+if __name__ == '__main__':
+    import sys
+    from screen import Screen
+
+    # record the game window: python frame_source.py <path> <seconds>
+    screen = Screen()
+    screen.set_source(RecordingFrameSource(LiveFrameSource(), sys.argv[1]))
+    screen.start()
+    end = time.perf_counter() + float(sys.argv[2])
+    while time.perf_counter() < end:
+        screen.grab()
+        time.sleep(0.04)
+    screen.source.close()
@@ -1,4 +1,5 @@
 import os
+import asyncio
 import time
 import random
 
@@ -11,3 +12,9 @@ def wait(lower, higher=None):
     if higher is None:
         higher = lower
     time.sleep(random.uniform(lower, higher))
+
+
+async def wait_async(lower, higher=None):
+    if higher is None:
+        higher = lower
+    await asyncio.sleep(random.uniform(lower, higher))
@@ -0,0 +1,236 @@
+"""
+Input gestures compiled into timelines of timestamped events and played back against time.perf_counter.
+
+Sleeping once per step lets OS timer granularity add up, so a move of 50 ms planned in 6 sleeps can take several
+times as long. The scheduler instead waits for absolute target times: it sleeps until shortly before an event and
+spins for the rest, so errors do not accumulate over a gesture.
+"""
+import time
+import asyncio
+from dataclasses import dataclass, field
+import numpy as np
+
+from config import Config
+
+
+@dataclass
+class InputEvent:
+    # seconds after the start of the timeline
+    t: float
+    # name of the InputBackend method to call
+    action: str
+    args: tuple = ()
+
+
+@dataclass
+class TimingReport:
+    planned: float = 0.0
+    achieved: float = 0.0
+    # achieved - planned time of every event
+    errors: list[float] = field(default_factory=list)
+
+    @property
+    def max_error(self) -> float:
+        return max(self.errors, default=0.0)
+
+    @property
+    def mean_error(self) -> float:
+        return sum(self.errors) / len(self.errors) if self.errors else 0.0
+
+
+class Timeline:
+    def __init__(self):
+        self.events: list[InputEvent] = []
+
+    @property
+    def duration(self) -> float:
+        return self.events[-1].t if self.events else 0.0
+
+    def add(self, t: float, action: str, *args) -> "Timeline":
+        self.events.append(InputEvent(t, action, args))
+        return self
+
+    def then(self, delay: float, action: str, *args) -> "Timeline":
+        """
+        Add an event delay seconds after the last one.
+        """
+        return self.add(self.duration + delay, action, *args)
+
+    def extend(self, other: "Timeline", delay: float = 0.0) -> "Timeline":
+        """
+        Append all events of other, shifted to start delay seconds after the last event of this timeline.
+        """
+        start = self.duration + delay
+        self.events += [InputEvent(start + e.t, e.action, e.args) for e in other.events]
+        return self
+
+
+def compile_move(points: list[tuple[float, float]], duration: float,
+                 step_rate: float = Config.input['step_rate']) -> Timeline:
+    """
+    Cursor path through points in duration seconds, with straight segments between the points sampled at step_rate,
+    like mouse.move(..., duration=...) moves between two points. Every segment takes the same time.
+    """
+    timeline = Timeline()
+    points = np.asarray(points, dtype=float)
+    segments = len(points) - 1
+    if segments < 1:
+        if len(points):
+            timeline.add(0.0, "move", int(points[0][0]), int(points[0][1]))
+        return timeline
+    steps = max(1, int(duration * step_rate / segments))
+    # sample parameter of every step along all segments, the first point is where the cursor already is
+    s = np.arange(1, segments * steps + 1) / steps
+    i = np.minimum(s.astype(int), segments - 1)
+    path = points[i] + (points[i + 1] - points[i]) * (s - i)[:, None]
+    times = s * (duration / segments)
+    last = None
+    for t, (x, y) in zip(times.tolist(), path.round().astype(int).tolist()):
+        if (x, y) != last:
+            timeline.add(t, "move", x, y)
+            last = (x, y)
+    return timeline
+
+
+def compile_click(button: str, hold: float = 0.0) -> Timeline:
+    return Timeline().add(0.0, "press", button).add(hold, "release", button)
+
+
+def compile_write(text: str, delay: float) -> Timeline:
+    """
+    Type text with delay seconds between the characters, like keyboard.write(text, delay=delay).
+    """
+    timeline = Timeline()
+    for i, character in enumerate(text):
+        timeline.add(i * delay, "write", character)
+    return timeline
+
+
+class InputBackend:
+    def move(self, x: int, y: int):
+        raise NotImplementedError
+
+    def press(self, button: str):
+        raise NotImplementedError
+
+    def release(self, button: str):
+        raise NotImplementedError
+
+    def send(self, key: str):
+        raise NotImplementedError
+
+    def write(self, text: str):
+        raise NotImplementedError
+
+
+class OsInputBackend(InputBackend):
+    """
+    Sends input to the OS with the mouse and keyboard packages.
+    """
+
+    def __init__(self):
+        import mouse
+        import keyboard
+        self._mouse = mouse
+        self._keyboard = keyboard
+
+    def move(self, x: int, y: int):
+        self._mouse.move(x, y)
+
+    def press(self, button: str):
+        self._mouse.press(button)
+
+    def release(self, button: str):
+        self._mouse.release(button)
+
+    def send(self, key: str):
+        self._keyboard.send(key)
+
+    def write(self, text: str):
+        self._keyboard.write(text)
+
+
+class NullInputBackend(InputBackend):
+    """
+    Sends nothing, but records (perf_counter time, action, args) of every call.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def _record(self, action: str, *args):
+        self.calls.append((time.perf_counter(), action, args))
+
+    def move(self, x: int, y: int):
+        self._record("move", x, y)
+
+    def press(self, button: str):
+        self._record("press", button)
+
+    def release(self, button: str):
+        self._record("release", button)
+
+    def send(self, key: str):
+        self._record("send", key)
+
+    def write(self, text: str):
+        self._record("write", text)
+
+
+def sleep_until(target: float, spin_threshold: float = Config.input['spin_threshold']):
+    """
+    Wait until time.perf_counter() reaches target. Sleeps while more than spin_threshold is left, then busy waits.
+    """
+    remaining = target - time.perf_counter()
+    if remaining > spin_threshold:
+        time.sleep(remaining - spin_threshold)
+    while time.perf_counter() < target:
+        pass
+
+
+class TimelineScheduler:
+    def __init__(self, backend: InputBackend = None, spin_threshold: float = Config.input['spin_threshold']):
+        self.backend = backend
+        self.spin_threshold = spin_threshold
+        self.last_report: TimingReport = None
+
+    def _backend(self) -> InputBackend:
+        if self.backend is None:
+            self.backend = OsInputBackend()
+        return self.backend
+
+    def run(self, timeline: Timeline) -> TimingReport:
+        """
+        Play timeline back, blocking until its last event was sent.
+        """
+        backend = self._backend()
+        report = TimingReport(planned=timeline.duration)
+        start = time.perf_counter()
+        for event in timeline.events:
+            sleep_until(start + event.t, self.spin_threshold)
+            report.errors.append(time.perf_counter() - start - event.t)
+            getattr(backend, event.action)(*event.args)
+        report.achieved = time.perf_counter() - start
+        self.last_report = report
+        return report
+
+    async def run_async(self, timeline: Timeline) -> TimingReport:
+        """
+        Like run, but awaits between events instead of spinning, so other tasks keep running. Errors are bound by
+        the event loop's timer resolution instead of spin_threshold.
+        """
+        backend = self._backend()
+        report = TimingReport(planned=timeline.duration)
+        start = time.perf_counter()
+        for event in timeline.events:
+            remaining = start + event.t - time.perf_counter()
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+            report.errors.append(time.perf_counter() - start - event.t)
+            getattr(backend, event.action)(*event.args)
+        report.achieved = time.perf_counter() - start
+        self.last_report = report
+        return report
+
+
+scheduler = TimelineScheduler()
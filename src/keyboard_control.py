@@ -1,6 +1,7 @@
 import keyboard
 from config import Config
-from human_behavior import wait
+from human_behavior import wait, wait_async
+from input_timeline import compile_write, scheduler
 
 
 class Keyboard:
@@ -39,3 +40,24 @@ class Keyboard:
     @staticmethod
     def esc():
         keyboard.send('esc')
+
+    @staticmethod
+    async def write_async(text: str, delay: float = .20):
+        """
+        Like keyboard.write with delay, but yields to the event loop between characters instead of sleeping.
+        """
+        await scheduler.run_async(compile_write(text, delay))
+
+    @staticmethod
+    async def set_no_pick_async():
+        keyboard.send('enter')
+        await wait_async(0.1, 0.25)
+        await Keyboard.write_async('/nopickup', delay=.20)
+        keyboard.send('enter')
+
+    @staticmethod
+    async def set_fps_async():
+        keyboard.send('enter')
+        await wait_async(0.1, 0.25)
+        await Keyboard.write_async('/fps', delay=.20)
+        keyboard.send('enter')
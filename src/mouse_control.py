@@ -6,11 +6,18 @@ import numpy as np
 import random
 import math
 import time
+from functools import lru_cache
 import screen
-from config import Config
-from utils.misc import is_in_roi
-from logger import Logger
+from utils import is_in_roi
+from loguru import logger
 import template_finder
+from ui_control import ScreenObjects
+import tracing
+import resolution
+from input_timeline import Timeline, compile_move, sleep_until, scheduler
+
+# score the gold button needs before clicks are restricted, GoldBtnInventory itself uses the default threshold
+INVENTORY_OPEN_THRESHOLD = 0.8
 
 
 def isNumeric(val):
@@ -56,18 +63,27 @@ class BezierCurve:
 
         return bern
 
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def bernsteinBasis(n, ts):
+        """
+        Returns the (len(ts), n + 1) matrix of all bernstein polynomials of degree n evaluated at
+        the parameters ts. Multiplying it with the control points yields the curve points at ts.
+        """
+        t = np.asarray(ts, dtype=float)[:, None]
+        i = np.arange(n + 1)
+        binomials = np.array([math.comb(n, k) for k in i], dtype=float)
+        return binomials * t ** i * (1 - t) ** (n - i)
+
     @staticmethod
     def curvePoints(n, points):
         """
         Given list of control points, returns n points in the bezier curve,
         described by these points
         """
-        curvePoints = []
-        bernstein_polynomial = BezierCurve.bernsteinPolynomial(points)
-        for i in range(n):
-            t = i / (n - 1)
-            curvePoints += bernstein_polynomial(t),
-        return curvePoints
+        ts = tuple(np.linspace(0, 1, n))
+        curvePoints = BezierCurve.bernsteinBasis(len(points) - 1, ts) @ np.asarray(points, dtype=float)
+        return [tuple(p) for p in curvePoints.tolist()]
 
 
 class HumanCurve():
@@ -102,10 +118,44 @@ class HumanCurve():
 
         internalKnots = self.generateInternalKnots(leftBoundary, rightBoundary, \
                                                    downBoundary, upBoundary, knotsCount)
-        points = self.generatePoints(internalKnots)
-        points = self.distortPoints(points, distortionMean, distortionStdev, distortionFrequency)
-        points = self.tweenPoints(points, tween, targetPoints)
-        return points
+        if not (isNumeric(distortionMean) and isNumeric(distortionStdev) and \
+                isNumeric(distortionFrequency)):
+            raise ValueError("Distortions must be numeric")
+        if not (0 <= distortionFrequency <= 1):
+            raise ValueError("distortionFrequency must be in range [0,1]")
+        if not isinstance(targetPoints, int) or targetPoints < 2:
+            raise ValueError("targetPoints must be an integer greater or equal to 2")
+
+        # Same result as generatePoints -> distortPoints -> tweenPoints, but the curve is
+        # only evaluated at the targetPoints parameters that tweening would pick.
+        knots = np.asarray([self.fromPoint] + internalKnots + [self.toPoint], dtype=float)
+        indices, ts = self.tweenParameters(self.curvePointsCount(), tween, targetPoints)
+        points = BezierCurve.bernsteinBasis(len(knots) - 1, ts) @ knots
+
+        # a point picked twice by tweening gets the same distortion; the end points are never distorted
+        unique, inverse = np.unique(indices, return_inverse=True)
+        delta = np.where(np.random.random(len(unique)) < distortionFrequency,
+                         np.random.normal(distortionMean, distortionStdev, len(unique)), 0)
+        delta[(unique == 0) | (unique == indices[-1])] = 0
+        points[:, 1] += delta[inverse]
+        return [tuple(p) for p in points.tolist()]
+
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def tweenParameters(pointsCount, tween, targetPoints):
+        """
+        Returns the indices tweenPoints would pick from a curve of pointsCount points and
+        the matching curve parameters in [0,1].
+        """
+        indices = np.array([int(tween(float(i) / (targetPoints - 1)) * (pointsCount - 1))
+                            for i in range(targetPoints)])
+        return indices, tuple((indices / (pointsCount - 1)).tolist())
+
+    def curvePointsCount(self):
+        return max( \
+            abs(self.fromPoint[0] - self.toPoint[0]), \
+            abs(self.fromPoint[1] - self.toPoint[1]), \
+            2)
 
     def generateInternalKnots(self, \
                               leftBoundary, rightBoundary, \
@@ -140,10 +190,7 @@ class HumanCurve():
         if not isListOfPoints(knots):
             raise ValueError("knots must be valid list of points")
 
-        midPtsCnt = max( \
-            abs(self.fromPoint[0] - self.toPoint[0]), \
-            abs(self.fromPoint[1] - self.toPoint[1]), \
-            2)
+        midPtsCnt = self.curvePointsCount()
         knots = [self.fromPoint] + knots + [self.toPoint]
         return BezierCurve.curvePoints(midPtsCnt, knots)
 
@@ -193,11 +240,7 @@ class HumanCurve():
 class mouse:
     @staticmethod
     def sleep(duration, get_now=time.perf_counter):
-        time.sleep(duration)
-        # now = get_now()
-        # end = now + duration
-        # while now < end:
-        #     now = get_now()
+        sleep_until(get_now() + duration)
 
     @staticmethod
     def _move_to(x, y, absolute=True, duration=0):
@@ -217,25 +260,19 @@ class mouse:
             y = position_y + y
 
         if duration:
-            start_x = position_x
-            start_y = position_y
-            dx = x - start_x
-            dy = y - start_y
-
-            if dx == 0 and dy == 0:
+            if (x, y) == (position_x, position_y):
                 mouse.sleep(duration)
             else:
-                # 120 movements per second.
-                # Round and keep float to ensure float division in Python 2
-                steps = max(1.0, float(int(duration * 120.0)))
-                for i in range(int(steps) + 1):
-                    mouse.move(start_x + dx * i / steps, start_y + dy * i / steps)
-                    mouse.sleep(duration / steps)
+                scheduler.run(compile_move([(position_x, position_y), (x, y)], duration))
         else:
             _winmouse.move_to(x, y)
 
-    def move(x, y, absolute: bool = True, randomize: int | tuple[int, int] = 5,
-             delay_factor: tuple[float, float] = [0.4, 0.6]):
+    @staticmethod
+    def _plan_move(x, y, absolute: bool, randomize: int | tuple[int, int],
+                   delay_factor: tuple[float, float]) -> Timeline:
+        """
+        :return: Timeline of a human-like move to (x, y).
+        """
         from_point = _mouse.get_position()
         dist = math.dist((x, y), from_point)
         offsetBoundaryX = max(10, int(0.08 * dist))
@@ -260,39 +297,54 @@ class mouse:
                                  targetPoints=targetPoints)
 
         duration = min(0.5, max(0.05, dist * 0.0004) * random.uniform(delay_factor[0], delay_factor[1]))
-        delta = duration / len(human_curve.points)
+        return compile_move(human_curve.points, duration)
 
-        for point in human_curve.points:
-            _mouse.move(point[0], point[1], duration=delta)
+    def move(x, y, absolute: bool = True, randomize: int | tuple[int, int] = 5,
+             delay_factor: tuple[float, float] = [0.4, 0.6]):
+        timeline = mouse._plan_move(x, y, absolute, randomize, delay_factor)
+        with tracing.span("move", "input", planned=timeline.duration, steps=len(timeline.events)) as span:
+            report = scheduler.run(timeline)
+            span.set(achieved=report.achieved, max_error=report.max_error)
+
+    @staticmethod
+    async def move_async(x, y, absolute: bool = True, randomize: int | tuple[int, int] = 5,
+                         delay_factor: tuple[float, float] = [0.4, 0.6]):
+        """
+        Same motion as move, but awaits between the points so other tasks, e.g. vision checks, run mid-motion.
+        Cancelling the task stops the cursor where it is.
+        """
+        timeline = mouse._plan_move(x, y, absolute, randomize, delay_factor)
+        with tracing.span("move", "input", planned=timeline.duration, steps=len(timeline.events)) as span:
+            report = await scheduler.run_async(timeline)
+            span.set(achieved=report.achieved, max_error=report.max_error)
 
     @staticmethod
     def _is_clicking_safe():
         # Because of reports that botty lost equiped items, let's check if the inventory is open, and if it is, restrict the mouse move
         mouse_pos = screen.convert_monitor_to_screen(_mouse.get_position())
-        is_inventory_open = template_finder.search(
-            "INVENTORY_GOLD_BTN",
-            screen.grab(),
-            threshold=0.8,
-            roi=Config().ui_roi["gold_btn"],
-            use_grayscale=True
-        ).valid
+        # usually answered by the state detector's result of a frame or two ago instead of a new grab and match
+        gold_btn = template_finder.recent_detection(ScreenObjects.GoldBtnInventory)
+        is_inventory_open = gold_btn.valid and gold_btn.score >= INVENTORY_OPEN_THRESHOLD
         if is_inventory_open:
-            is_in_equipped_area = is_in_roi(Config().ui_roi["equipped_inventory_area"], mouse_pos)
-            is_in_restricted_inventory_area = is_in_roi(Config().ui_roi["restricted_inventory_area"], mouse_pos)
+            rois = resolution.roi_table()
+            is_in_equipped_area = is_in_roi(rois["equipped_inventory_area"], mouse_pos)
+            is_in_restricted_inventory_area = is_in_roi(rois["restricted_inventory_area"], mouse_pos)
             if is_in_restricted_inventory_area or is_in_equipped_area:
-                Logger.error("Mouse wants to click in equipped area. Cancel action.")
+                logger.error("Mouse wants to click in equipped area. Cancel action.")
                 return False
         return True
 
     @staticmethod
     def click(button):
-        if button != "left" or mouse._is_clicking_safe():
-            _mouse.click(button)
+        with tracing.span("click", "input", button=button):
+            if button != "left" or mouse._is_clicking_safe():
+                _mouse.click(button)
 
     @staticmethod
     def press(button):
-        if button != "left" or mouse._is_clicking_safe():
-            _mouse.press(button)
+        with tracing.span("press", "input", button=button):
+            if button != "left" or mouse._is_clicking_safe():
+                _mouse.press(button)
 
     @staticmethod
     def release(button):
@@ -0,0 +1,145 @@
+import os
+import cv2
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from screen import Screen
+import resolution
+from ui_control import ScreenObject
+from template_finder import TemplateMatch, _resolve_roi, _process_template_refs, _single_template_match, \
+    _feature_match, stored_templates
+
+# worker process side: shared memory name -> (ring generation, attached SharedMemory)
+_attached = {}
+
+
+def _worker_init():
+    # every worker runs one matchTemplate at a time, opencv's own threads would only compete with the other workers
+    cv2.setNumThreads(1)
+
+
+def _attach(name: str, shape: tuple, dtype: str, generation: int) -> np.ndarray:
+    if name not in _attached:
+        # buffers of an older generation were unlinked when the ring grew, only this handle keeps them mapped
+        for old in [n for n, (g, _) in _attached.items() if g < generation]:
+            _attached.pop(old)[1].close()
+        _attached[name] = (generation, shared_memory.SharedMemory(name=name))
+    return np.ndarray(shape, dtype=dtype, buffer=_attached[name][1].buf)
+
+
+def _match_job(frame_spec: tuple, monitor_offset: tuple, scale: float, template_name: str, roi: list,
+               color_match: list, use_grayscale: bool, use_pyramid: bool, use_features: bool = False) -> TemplateMatch:
+    Screen.monitor["left"], Screen.monitor["top"] = monitor_offset
+    # rois come resolved at the parent's ui scale, the templates have to match it
+    resolution.set_scale(scale)
+    frame = _attach(*frame_spec)
+    template = _process_template_refs(template_name, color_match, use_grayscale, use_features)[0]
+    if use_features:
+        return _feature_match(template, frame, roi)
+    return _single_template_match(template, frame, roi, color_match, use_grayscale, use_pyramid)
+
+
+class SharedFrameRing:
+    """
+    Shared memory buffers frames are copied into before matching, reused in turn so workers only attach once per
+    buffer. Frames are copied once instead of being pickled with every job.
+    """
+
+    def __init__(self, size: int = 4):
+        self.size = size
+        self.buffers = []
+        self.index = -1
+        # bumped whenever the buffers are replaced, so workers can let go of the old ones
+        self.generation = 0
+
+    def put(self, frame: np.ndarray) -> tuple:
+        """
+        :return: (shared memory name, shape, dtype, generation) of the buffer frame was copied into.
+        """
+        if not self.buffers or self.buffers[0].size < frame.nbytes:
+            self.close()
+            self.buffers = [shared_memory.SharedMemory(create=True, size=frame.nbytes) for _ in range(self.size)]
+            self.generation += 1
+        self.index = (self.index + 1) % self.size
+        shm = self.buffers[self.index]
+        np.copyto(np.ndarray(frame.shape, dtype=frame.dtype, buffer=shm.buf), frame)
+        return shm.name, frame.shape, frame.dtype.str, self.generation
+
+    def close(self):
+        for shm in self.buffers:
+            shm.close()
+            shm.unlink()
+        self.buffers = []
+
+
+class ParallelMatcher:
+    """
+    Fans template matching out over a pool of worker processes. Each worker loads the templates it needs from the
+    shared, memory-mapped template store and reads frames from shared memory.
+    Results have the same semantics as template_finder.search and detect_screen_object.
+    """
+
+    def __init__(self, workers: int = None):
+        # make sure the template store is built before the workers open it
+        stored_templates().store
+        self.workers = workers or os.cpu_count()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_worker_init)
+        self.frames = SharedFrameRing()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self.frames.close()
+
+    def _submit(self, frame_spec: tuple, names: list[str], roi: list, color_match: list, use_grayscale: bool,
+                use_pyramid: bool, monitor_offset: tuple[int, int] = None, use_features: bool = False) -> list:
+        offset = monitor_offset or (Screen.monitor["left"] or 0, Screen.monitor["top"] or 0)
+        scale = resolution.current_scale()
+        return [self.pool.submit(_match_job, frame_spec, offset, scale, name, roi, color_match, use_grayscale,
+                                 use_pyramid, use_features) for name in names]
+
+    @staticmethod
+    def _collect(futures: list, threshold: float, best_match: bool) -> TemplateMatch:
+        # results are taken in template order, so without best_match the same template wins as in a serial search
+        best = TemplateMatch()
+        for i, future in enumerate(futures):
+            template_match = future.result()
+            if not template_match.valid or template_match.score < threshold:
+                continue
+            if not best_match:
+                for f in futures[i + 1:]:
+                    f.cancel()
+                return template_match
+            if template_match.score > best.score:
+                best = template_match
+        return best
+
+    def search(self, ref: str | list[str], inp_img: np.ndarray = None, threshold: float = 0.68, roi: list = None,
+               color_match: list = None, use_grayscale: bool = False, best_match: bool = False,
+               use_pyramid: bool = False) -> TemplateMatch:
+        """
+        template_finder.search with one job per template. Only named templates are supported.
+        """
+        names = ref if type(ref) == list else [ref]
+        inp_img = inp_img if inp_img is not None else Screen().grab()
+        futures = self._submit(self.frames.put(inp_img), names, roi, color_match, use_grayscale, use_pyramid)
+        return self._collect(futures, threshold, best_match)
+
+    def detect_all(self, screen_objects: list[ScreenObject], inp_img: np.ndarray = None,
+                   monitor_offset: tuple[int, int] = None) -> dict[str, TemplateMatch]:
+        """
+        Check several ScreenObjects on one frame, with all of their templates matched concurrently.
+        :param monitor_offset: Screen position of inp_img used for the *_monitor fields. Defaults to Screen.monitor.
+        :return: ScreenObject key -> TemplateMatch, like detect_screen_object would return it.
+        """
+        inp_img = inp_img if inp_img is not None else Screen().grab()
+        frame_spec = self.frames.put(inp_img)
+        futures = {o.key: (o, self._submit(frame_spec, o.name, _resolve_roi(o), o.color_match, o.use_grayscale,
+                                           o.use_pyramid, monitor_offset, o.use_features)) for o in screen_objects}
+        return {key: self._collect(f, o.threshold, o.best_match) for key, (o, f) in futures.items()}
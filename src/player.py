@@ -1,5 +1,8 @@
-from mouse_control import Mouse
+from mouse_control import mouse as Mouse
 from screen import Screen
+from screen_watch import screen_watcher
+from template_finder import TemplateMatch
+from ui_control import ScreenObject
 import keyboard
 
 
@@ -7,11 +10,18 @@ class Player:
     screen = Screen()
     mouse = Mouse()
 
-    def wait_until_hidden(self):
-        pass
+    def wait_until_hidden(self, screen_object: ScreenObject, timeout: float = 10.0) -> bool:
+        """
+        :return: True as soon as screen_object is not visible anymore, False if it is still visible after timeout or
+        could not be checked in time.
+        """
+        return screen_watcher().wait_until_hidden(screen_object, timeout)
 
-    def wait_until_visible(self):
-        pass
+    def wait_until_visible(self, screen_object: ScreenObject, timeout: float = 10.0) -> TemplateMatch:
+        """
+        :return: Valid TemplateMatch as soon as screen_object is visible, or an invalid one after timeout.
+        """
+        return screen_watcher().wait_until_visible(screen_object, timeout)
 
     def enable_no_pick(self):
         pass
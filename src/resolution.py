@@ -0,0 +1,127 @@
+"""
+Templates and Config.ui_roi are made for a Config.ui['window_width'] x Config.ui['window_height'] client area. For any
+other size, they are scaled by the ui scale set here. The game keeps its aspect ratio and centres the scaled ui in
+the client area, so rois are also shifted by the letterbox offset. Scaled rois and template variants are cached per
+scale.
+"""
+import cv2
+import numpy as np
+
+from config import Config
+
+# scales are rounded to this many digits, so that cached tables are shared between almost equal sizes
+SCALE_DIGITS = 3
+# scaled roi tables kept at a time, more are only needed while calibrating the scale
+ROI_TABLE_CACHE_SIZE = 16
+
+_scale = 1.0
+# (width, height) of the game window's client area, None while it is unknown and assumed to fit the ui exactly
+_client_size = None
+# (the Config.ui_roi the tables were scaled from, (scale, offset) -> scaled roi table)
+_roi_tables = (None, {})
+
+
+def base_size() -> tuple[int, int]:
+    return Config.ui['window_width'], Config.ui['window_height']
+
+
+def current_scale() -> float:
+    return _scale
+
+
+def set_scale(scale: float):
+    global _scale
+    _scale = round(scale, SCALE_DIGITS)
+
+
+def client_size() -> tuple[int, int] | None:
+    return _client_size
+
+
+def set_client_size(width: int, height: int):
+    """
+    Set the size of the game window's client area and the ui scale that fits it.
+    """
+    global _client_size
+    _client_size = (width, height)
+    set_scale(scale_for_size(width, height))
+
+
+def frame_size(scale: float = None) -> tuple[int, int]:
+    """
+    :return: (width, height) of a captured frame: the client size, or the ui size at scale if it is unknown.
+    """
+    if _client_size is not None:
+        return _client_size
+    scale = _scale if scale is None else scale
+    width, height = base_size()
+    return round(width * scale), round(height * scale)
+
+
+def ui_offset(scale: float = None) -> tuple[int, int]:
+    """
+    :return: (x, y) of the top left corner of the ui at scale within the client area, non-zero if it is letterboxed.
+    """
+    if _client_size is None:
+        return 0, 0
+    scale = _scale if scale is None else scale
+    width, height = base_size()
+    return max(0, (_client_size[0] - round(width * scale)) // 2), max(0, (_client_size[1] - round(height * scale)) // 2)
+
+
+def layout() -> tuple[float, tuple[int, int]]:
+    """
+    :return: (ui scale, frame size). Rois and frame coordinates stay valid as long as this does not change.
+    """
+    return _scale, frame_size()
+
+
+def scale_for_size(width: int, height: int) -> float:
+    """
+    :return: ui scale of a client area of width x height. The game letterboxes other aspect ratios, so the smaller
+    of both ratios is used.
+    """
+    base_width, base_height = base_size()
+    return round(min(width / base_width, height / base_height), SCALE_DIGITS)
+
+
+def scale_roi(roi: list[int], scale: float, offset: tuple[int, int] = (0, 0)) -> list[int]:
+    if scale == 1.0 and offset == (0, 0):
+        return roi
+    x, y, w, h = roi
+    x0, y0 = round(x * scale), round(y * scale)
+    return [x0 + offset[0], y0 + offset[1], max(1, round((x + w) * scale) - x0), max(1, round((y + h) * scale) - y0)]
+
+
+def roi_table(scale: float = None) -> dict[str, list[int]]:
+    """
+    :return: Config.ui_roi scaled to scale, the current scale by default, in client area coordinates.
+    """
+    scale = _scale if scale is None else scale
+    offset = ui_offset(scale)
+    if scale == 1.0 and offset == (0, 0):
+        return Config.ui_roi
+    global _roi_tables
+    rois, tables = _roi_tables
+    # Config.ui_roi may be replaced as a whole, tables of the old one are dropped then. Keeping a reference to it
+    # makes sure a new dict is never mistaken for it.
+    if rois is not Config.ui_roi or len(tables) >= ROI_TABLE_CACHE_SIZE:
+        rois, tables = Config.ui_roi, {}
+        _roi_tables = rois, tables
+    table = tables.get((scale, offset))
+    if table is None:
+        table = tables[(scale, offset)] = {name: scale_roi(roi, scale, offset) for name, roi in rois.items()}
+    return table
+
+
+def scale_image(img: np.ndarray, scale: float, is_mask: bool = False) -> np.ndarray:
+    """
+    Resize a template variant. Masks keep hard edges, images are area-averaged when shrinking like the game does.
+    """
+    h, w = img.shape[:2]
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    if is_mask:
+        interpolation = cv2.INTER_NEAREST
+    else:
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+    return cv2.resize(img, size, interpolation=interpolation)
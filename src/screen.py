@@ -1,15 +1,17 @@
 import time
+import asyncio
 import threading
-from win32gui import EnumWindows, GetClientRect, ClientToScreen
-from win32process import GetWindowThreadProcessId
 import os
-import psutil
 from loguru import logger
-from mss import mss
 import numpy as np
 import cv2
 from copy import deepcopy
 from config import Config
+import tracing
+import resolution
+from frame_source import FrameSource, LiveFrameSource
+from frame_buffer import Frame, FrameRing
+from window_tracker import WindowTracker
 
 
 class Screen:
@@ -20,6 +22,7 @@ class Screen:
     _instance = None
 
     game_hwnd = None
+    # replaced as a whole when the window moves, take a reference before reading left and top
     monitor = {
         "left": None,
         "top": None,
@@ -27,55 +30,205 @@ class Screen:
         "height": Config.ui['window_height'],
     }
 
-    sct = mss()
-    rt_image = None
+    source: FrameSource = None
+    frame_ring = FrameRing(Config.ui['capture_buffers'])
+    rt_image: Frame = None
     rt_image_lock = threading.Lock()
     rt_grab_time = 0
+    frame_seq = 0
+    # (rt_image, frame_seq), replaced as a whole so readers never need the lock
+    latest = None
+    frame_condition = threading.Condition(rt_image_lock)
 
-    find_window_thread = None
-    find_window_lock = threading.Lock()
+    capture_thread = None
+    capture_running = False
+    capture_period = 0.04
+    captured_frames = 0
+    dropped_frames = 0
+
+    # frame_seq of the last grab in which each tile changed. None if change detection is disabled.
+    tile_size = Config.ui['change_tile_size']
+    tile_seq = None
+    changed_tiles = None
+
+    window_tracker: WindowTracker = None
+    source_lock = threading.Lock()
+
+    # callbacks(frame, frame_seq) run on the capturing thread after every published frame. Replaced as a whole on
+    # change, so _capture can iterate it without a lock.
+    frame_listeners = ()
+    frame_listeners_lock = threading.Lock()
 
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
             cls._instance = super(Screen, cls).__new__(cls, *args, **kwargs)
         return cls._instance
 
+    def set_source(self, source: FrameSource):
+        """
+        Replace the frame source behind grab, e.g. with a RecordingFrameSource or ReplayFrameSource.
+        """
+        with self.source_lock:
+            self.source = source
+        with self.rt_image_lock:
+            self.rt_image = None
+            self.latest = None
+
     def start(self):
-        self._find_d2r_window()
-        if self.find_window_thread is None:
-            self.find_window_thread = threading.Thread(target=self.find_d2r_window, daemon=True)
-        if not self.find_window_thread.is_alive():
-            self.find_window_thread.start()
+        if self.source is None:
+            self.source = LiveFrameSource()
+        if not self.source.needs_window:
+            Screen.monitor = {**Screen.monitor, "left": 0, "top": 0}
+            return
+        if self.window_tracker is None:
+            self.window_tracker = WindowTracker(on_change=self._on_window_change)
+        self.window_tracker.poll()
+        self.window_tracker.start()
+
+    def _on_window_change(self, hwnd: int | None, rect: tuple[int, int, int, int] | None):
+        self.game_hwnd = hwnd
+        if rect is not None:
+            left, top, width, height = rect
+            if width <= 0 or height <= 0:
+                # minimized
+                return
+            if (width, height) != (Screen.monitor["width"], Screen.monitor["height"]):
+                resolution.set_client_size(width, height)
+            Screen.monitor = {"left": left, "top": top, "width": width, "height": height}
+
+    def start_capture(self, fps: float = 25):
+        """
+        Start a thread that captures at fps and publishes every new frame. While it runs, grab returns the latest
+        published frame without blocking.
+        :param fps: Target capture rate. Frames that cannot be captured in time are counted in dropped_frames.
+        """
+        if self.capture_thread is not None and self.capture_thread.is_alive():
+            return
+        self.capture_running = True
+        self.capture_period = 1 / fps
+        self.capture_thread = threading.Thread(target=self._capture_loop, args=(fps,), daemon=True)
+        self.capture_thread.start()
+
+    def stop_capture(self):
+        self.capture_running = False
+        if self.capture_thread is not None:
+            self.capture_thread.join()
+            self.capture_thread = None
+
+    def _capture_loop(self, fps: float):
+        period = 1 / fps
+        next_time = time.perf_counter()
+        while self.capture_running:
+            try:
+                self._capture()
+            except Exception as e:
+                logger.warning(f"Capture failed: {e}")
+                if self.window_tracker is not None:
+                    self.window_tracker.wake()
+            next_time += period
+            now = time.perf_counter()
+            if now > next_time:
+                # capture took longer than a period, skip the frames that could not be taken in time
+                missed = int((now - next_time) / period) + 1
+                self.dropped_frames += missed
+                next_time += missed * period
+            else:
+                time.sleep(next_time - now)
+
+    def capture_stats(self) -> dict:
+        return {"captured": self.captured_frames, "dropped": self.dropped_frames, "seq": self.frame_seq}
+
+    def latest_frame(self) -> tuple[Frame, int] | None:
+        """
+        :return: (frame, frame_seq) of the most recent capture without blocking, or None before the first one.
+        """
+        return self.latest
+
+    def wait_for_frame(self, after_seq: int, timeout: float = None) -> tuple[Frame, int] | None:
+        """
+        Block until a frame newer than after_seq has been captured.
+        :return: (frame, frame_seq), or None on timeout.
+        """
+        with self.frame_condition:
+            if not self.frame_condition.wait_for(lambda: self.frame_seq > after_seq, timeout):
+                return None
+            return self.latest
+
+    def hold(self, frame: Frame) -> Frame:
+        """
+        Copy a grabbed frame for checks that take longer than the capture ring keeps frames, i.e. more than
+        Config.ui['capture_buffers'] - 2 capture periods (about 80 ms at the default 4 buffers and 25 fps). The copy
+        keeps frame_seq, so caches keyed on it still apply.
+        :return: The copy. If the buffer behind frame was already being reused, a copy of the latest frame. Arrays
+        that are not backed by the capture ring, e.g. frames that are already held, are returned as they are.
+        """
+        while getattr(frame, "seq", 0) and any(frame.base is b for b in self.frame_ring.buffers):
+            held = np.array(frame)
+            if self.frame_ring.is_valid(frame, self.frame_seq):
+                return self.frame_ring.publish(held, frame.seq)
+            logger.debug(f"Frame {frame.seq} was overwritten before it could be held, holding the latest one")
+            frame = self.latest[0]
+        return frame
+
+    def add_frame_listener(self, callback):
+        """
+        Call callback(frame, frame_seq) for every new frame. It runs on the capturing thread and has to return fast.
+        """
+        with self.frame_listeners_lock:
+            self.frame_listeners = self.frame_listeners + (callback,)
+
+    def remove_frame_listener(self, callback):
+        with self.frame_listeners_lock:
+            self.frame_listeners = tuple(c for c in self.frame_listeners if c is not callback)
+
+    async def next_frame(self, after_seq: int = None, timeout: float = None) -> tuple[Frame, int]:
+        """
+        Wait for a frame newer than after_seq without blocking the event loop.
+        :param after_seq: frame_seq the returned frame has to be newer than. Defaults to the latest frame.
+        :return: (frame, frame_seq)
+        :raises asyncio.TimeoutError: If no new frame was captured within timeout.
+        """
+        latest = self.latest
+        if after_seq is None:
+            after_seq = latest[1] if latest is not None else 0
+        if not self.capture_running:
+            if latest is not None and latest[1] > after_seq:
+                return latest
+            return await asyncio.wait_for(self._paced_grab(), timeout)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(result):
+            if not future.done():
+                future.set_result(result)
+
+        def on_frame(frame, seq):
+            if seq > after_seq:
+                loop.call_soon_threadsafe(resolve, (frame, seq))
+
+        self.add_frame_listener(on_frame)
+        try:
+            latest = self.latest
+            if latest is not None and latest[1] > after_seq:
+                return latest
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.remove_frame_listener(on_frame)
+
+    async def _paced_grab(self) -> tuple[Frame, int]:
+        # without a capture thread, grab at most once per capture period, like the capture thread would
+        delay = self.rt_grab_time + self.capture_period - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return await asyncio.to_thread(self.grab_frame, True)
 
     def stop(self):
-        if self.find_window_thread is not None:
-            self.find_window_thread.join()
+        self.stop_capture()
+        if self.window_tracker is not None:
+            self.window_tracker.stop()
             self.game_hwnd = None
             self.rt_image = None
-
-    def _find_d2r_window(self):
-        if not self.game_hwnd:
-            window_list = []
-            EnumWindows(lambda w, l: l.append(w), window_list)
-            for hwnd in window_list:
-                _, process_id = GetWindowThreadProcessId(hwnd)
-                if process_id > 0 and Config.game['window_process'] in psutil.Process(process_id).name():
-                    self.game_hwnd = hwnd
-                    break
-        if self.game_hwnd:
-            try:
-                left, top, _, _ = GetClientRect(self.game_hwnd)
-                with self.find_window_lock:
-                    self.monitor["left"], self.monitor["top"] = ClientToScreen(self.game_hwnd, (left, top))
-            except BaseException:
-                self.game_hwnd = None
-        else:
-            logger.debug("Game not found.")
-
-    def find_d2r_window(self):
-        while True:
-            self._find_d2r_window()
-            time.sleep(1)
+            self.latest = None
 
     def grab(self, require_new: bool = False):
         """
@@ -83,16 +236,89 @@ class Screen:
         less than 40ms, the last cached screenshot will be returned (because the actual in-game operation frame
         rate is 25FPS).
         :param require_new: bool. If it is true, a new screenshot is forced to be returned.
-        :return: Screenshots that contain only the contents of the game window.
-        """
-        c = time.perf_counter()
-        if require_new or time.perf_counter() - self.rt_grab_time > 0.04 or self.rt_image is None:
-            with self.find_window_lock:
-                image = np.asarray(self.sct.grab(self.monitor))
-            with self.rt_image_lock:
-                self.rt_image = image[:, :, :3]
-        print(time.perf_counter() - c)
-        return self.rt_image
+        :return: Screenshots that contain only the contents of the game window. The returned Frame is a read-only
+        view into a reused capture buffer, tagged with its frame_seq. It is overwritten by the grab after
+        Config.ui['capture_buffers'] - 1 newer ones, use hold for anything that takes longer.
+        """
+        return self.grab_frame(require_new)[0]
+
+    def grab_frame(self, require_new: bool = False) -> tuple[Frame, int]:
+        """
+        Same as grab, but also returns the frame_seq of the returned screenshot.
+        """
+        latest = self.latest
+        if self.capture_running and latest is not None:
+            if require_new:
+                # captures may keep failing, e.g. while the window is lost. Do not wait for them forever.
+                return self.wait_for_frame(latest[1], 3 * self.capture_period) or self.latest
+            return latest
+        if require_new or time.perf_counter() - self.rt_grab_time > 0.04 or latest is None:
+            latest = self._capture()
+        return latest
+
+    def _capture(self) -> tuple[Frame, int]:
+        monitor = self.monitor
+        with tracing.span("capture", "capture", seq=self.frame_seq + 1), self.source_lock:
+            if self.source is None:
+                self.source = LiveFrameSource()
+            image = self.frame_ring.next_buffer(self.source.frame_shape(monitor))
+            self.source.grab_into(monitor, image)
+        with self.frame_condition:
+            if Config.ui['change_detection']:
+                self._update_changed_tiles(image)
+            self.frame_seq += 1
+            self.captured_frames += 1
+            self.rt_image = self.frame_ring.publish(image, self.frame_seq)
+            self.rt_grab_time = time.perf_counter()
+            self.latest = latest = (self.rt_image, self.frame_seq)
+            self.frame_condition.notify_all()
+        for callback in self.frame_listeners:
+            try:
+                callback(*latest)
+            except Exception as e:
+                logger.warning(f"Frame listener failed: {e}")
+        return latest
+
+    def _update_changed_tiles(self, image: np.ndarray):
+        h, w = image.shape[:2]
+        seq = self.frame_seq + 1
+        if self.rt_image is None or self.rt_image.shape != image.shape or self.tile_seq is None:
+            shape = (-(-h // self.tile_size), -(-w // self.tile_size))
+            self.changed_tiles = np.ones(shape, dtype=bool)
+            self.tile_seq = np.full(shape, seq, dtype=np.int64)
+            return
+        diff = np.any(image != self.rt_image, axis=2)
+        diff = np.logical_or.reduceat(diff, np.arange(0, h, self.tile_size), axis=0)
+        self.changed_tiles = np.logical_or.reduceat(diff, np.arange(0, w, self.tile_size), axis=1)
+        self.tile_seq[self.changed_tiles] = seq
+
+    def roi_changed_since(self, roi: list | None, seq: int) -> bool:
+        """
+        Check whether any pixel in roi may have changed after the grab with frame_seq seq.
+        :param roi: [x, y, w, h] in game window coordinates. None for the whole window.
+        :param seq: frame_seq to compare against.
+        :return: False only if change detection is enabled and all tiles covering roi are unchanged since seq.
+        """
+        tile_seq = self.tile_seq
+        if tile_seq is None:
+            return True
+        if roi is not None:
+            x, y, w, h = roi
+            ts = self.tile_size
+            tile_seq = tile_seq[y // ts:(y + h - 1) // ts + 1, x // ts:(x + w - 1) // ts + 1]
+        return tile_seq.size == 0 or int(tile_seq.max()) > seq
+
+
+def convert_screen_to_monitor(screen_coord: tuple[float, float]) -> tuple[int, int]:
+    x, y = screen_coord
+    monitor = Screen.monitor
+    return int(x + monitor["left"]), int(y + monitor["top"])
+
+
+def convert_monitor_to_screen(monitor_coord: tuple[float, float]) -> tuple[int, int]:
+    x, y = monitor_coord
+    monitor = Screen.monitor
+    return int(x - monitor["left"]), int(y - monitor["top"])
 
 
 if __name__ == '__main__':
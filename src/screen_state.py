@@ -0,0 +1,215 @@
+import cv2
+import numpy as np
+from dataclasses import dataclass, field
+
+from config import Config
+from screen import Screen
+from ui_control import ScreenObject, ScreenObjects
+from template_finder import TemplateMatch, _resolve_roi, _process_template_refs, _search_prepared, color_filter, \
+    record_detection, _search_features
+import tracing
+import resolution
+
+
+@dataclass
+class RegionGroup:
+    """
+    Union of overlapping rois. The frame is cropped and converted to gray / hsv once per group and frame.
+    """
+    roi: list[int]
+    objects: list[ScreenObject] = field(default_factory=list)
+
+
+@dataclass
+class Check:
+    screen_object: ScreenObject
+    group: RegionGroup
+    # roi in frame coordinates, offset of roi within the group
+    roi: list[int]
+    offset: tuple[int, int]
+    cost: float
+
+
+def _overlaps(a: list[int], b: list[int]) -> bool:
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+
+def _area(roi: list[int]) -> int:
+    return roi[2] * roi[3]
+
+
+def _union(a: list[int], b: list[int]) -> list[int]:
+    x, y = min(a[0], b[0]), min(a[1], b[1])
+    return [x, y, max(a[0] + a[2], b[0] + b[2]) - x, max(a[1] + a[3], b[1] + b[3]) - y]
+
+
+def check_cost(screen_object: ScreenObject, roi: list[int]) -> float:
+    """
+    Rough relative cost of checking screen_object: searched area times number of templates, BGR and color
+    matching correlate three channels and the pyramid search only refines small windows at full resolution.
+    """
+    cost = roi[2] * roi[3] * len(screen_object.name)
+    if screen_object.color_match or not screen_object.use_grayscale:
+        cost *= 3
+    if screen_object.use_pyramid:
+        cost /= 10
+    return cost
+
+
+class ScreenState:
+    """
+    Evaluates a set of ScreenObjects on one frame. The declarative ScreenObjects table is compiled once into a
+    plan: overlapping rois are merged into region groups that share one crop and color conversion per frame, and
+    checks are ordered from cheap to expensive, parents (see ScreenObject.parents) before their children.
+    """
+
+    def __init__(self, screen_objects: list[ScreenObject] = None, frame_size: tuple[int, int] = None,
+                 resync_frames: int = Config.ui['state_resync_frames']):
+        if screen_objects is None:
+            screen_objects = [o for o in vars(ScreenObjects).values() if isinstance(o, ScreenObject)]
+        self.screen_objects = screen_objects
+        self.fixed_frame_size = frame_size
+        self.parents = self._parents(screen_objects)
+        self._compile_for_scale()
+        self.resync_frames = resync_frames
+        self.frames_since_resync = None
+        self.visible = {}
+
+    @staticmethod
+    def _parents(screen_objects: list[ScreenObject]) -> dict[str, list[str]]:
+        """
+        :return: ScreenObject key -> keys of its parents. Parents outside of screen_objects are ignored, an object
+        without known parents is a root that is always checked.
+        """
+        keys = {o.key for o in screen_objects}
+        parents = {}
+        for o in screen_objects:
+            for p in o.parents or []:
+                if not hasattr(ScreenObjects, p):
+                    raise ValueError(f"Unknown parent {p} of ScreenObject {o.key}")
+            parents[o.key] = [p for p in o.parents or [] if p in keys]
+        return parents
+
+    def _depth(self, key: str, visiting: tuple = ()) -> int:
+        if key in visiting:
+            raise ValueError(f"ScreenObject parents form a cycle: {' -> '.join(visiting + (key,))}")
+        return max((self._depth(p, visiting + (key,)) + 1 for p in self.parents[key]), default=0)
+
+    def _compile_for_scale(self):
+        # rois depend on the ui scale and the letterbox offset, the plan is rebuilt whenever they change
+        self.layout = resolution.layout()
+        self.frame_size = self.fixed_frame_size or resolution.frame_size()
+        self.groups, self.plan = self._compile(self.screen_objects)
+
+    def _compile(self, screen_objects: list[ScreenObject]) -> tuple[list[RegionGroup], list[Check]]:
+        full_frame = [0, 0, *self.frame_size]
+        resolved = [_resolve_roi(o) for o in screen_objects]
+        rois = [roi or full_frame for roi in resolved]
+
+        # merge overlapping rois as long as converting the bounding box is not more work than converting both rois.
+        # Objects without roi get a group of their own, merging them would make every group convert the whole frame.
+        groups = [RegionGroup(list(roi), [o]) for o, roi in zip(screen_objects, resolved) if roi is not None]
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(groups)):
+                for j in range(i + 1, len(groups)):
+                    a, b = groups[i].roi, groups[j].roi
+                    if _overlaps(a, b) and _area(_union(a, b)) <= _area(a) + _area(b):
+                        groups[i].roi = _union(a, b)
+                        groups[i].objects += groups.pop(j).objects
+                        merged = True
+                        break
+                if merged:
+                    break
+        full_frame_objects = [o for o, roi in zip(screen_objects, resolved) if roi is None]
+        if full_frame_objects:
+            groups.append(RegionGroup(full_frame, full_frame_objects))
+
+        group_of = {id(o): g for g in groups for o in g.objects}
+        plan = []
+        for o, roi in zip(screen_objects, rois):
+            group = group_of[id(o)]
+            offset = (roi[0] - group.roi[0], roi[1] - group.roi[1])
+            plan.append(Check(o, group, roi, offset, check_cost(o, roi)))
+        depth = {o.key: self._depth(o.key) for o in screen_objects}
+        plan.sort(key=lambda c: (depth[c.screen_object.key], c.cost))
+        return groups, plan
+
+    def detect(self, inp_img: np.ndarray = None) -> dict[str, TemplateMatch]:
+        """
+        Like classify, but only checks ScreenObjects whose parents were visible in the previous frame or are
+        visible in this one. Every resync_frames frames (and on the first call) all ScreenObjects are checked.
+        :param inp_img: Frame to check. If None, a screenshot is taken.
+        :return: ScreenObject key -> TemplateMatch for every visible ScreenObject that was checked.
+        """
+        if self.frames_since_resync is None or self.frames_since_resync >= self.resync_frames:
+            self.frames_since_resync = 0
+            self.visible = self.classify(inp_img)
+            return self.visible
+        self.frames_since_resync += 1
+        previous = self.visible
+        self.visible = self.classify(inp_img, gate=lambda key, visible: not self.parents[key] or any(
+            p in previous or p in visible for p in self.parents[key]))
+        return self.visible
+
+    def classify(self, inp_img: np.ndarray = None, gate=None) -> dict[str, TemplateMatch]:
+        """
+        Check all ScreenObjects of the plan on one frame.
+        :param inp_img: Frame to check. If None, a screenshot is taken.
+        :param gate: Optional function (ScreenObject key, visible so far) -> bool. Only objects for which it returns
+        True are checked.
+        :return: ScreenObject key -> TemplateMatch for every visible ScreenObject.
+        """
+        # a full pass takes longer than the capture ring keeps a frame, it has to work on its own copy
+        inp_img = Screen().hold(inp_img if inp_img is not None else Screen().grab())
+        if resolution.layout() != self.layout:
+            self._compile_for_scale()
+        seq = getattr(inp_img, "seq", 0)
+        # id(group) -> {"bgr" | "gray" | "hsv": group crop}
+        prepared = {}
+        visible = {}
+        for check in self.plan:
+            o = check.screen_object
+            if gate is not None and not gate(o.key, visible):
+                # a gated object's parents are not visible, so neither is the object. It was not matched though, so
+                # it is not recorded: recent_detection has to fall back to a real match for it.
+                continue
+            with tracing.span(o.key, "match", seq=seq) as span:
+                img = self._prepare(inp_img, check, prepared)
+                templates = _process_template_refs(o.name, o.color_match, o.use_grayscale, o.use_features)
+                if o.use_features:
+                    # keypoints are cached per roi of the frame, not per region group
+                    template_match = _search_features(templates, inp_img, check.roi, o.threshold, o.best_match)
+                else:
+                    template_match = _search_prepared(templates, img, check.roi, o.threshold, o.color_match,
+                                                      o.use_grayscale, o.best_match, o.use_pyramid)
+                span.set(score=template_match.score, valid=template_match.valid)
+            record_detection(o.key, seq, template_match)
+            if template_match.valid:
+                visible[o.key] = template_match
+        return visible
+
+    @staticmethod
+    def _prepare(inp_img: np.ndarray, check: Check, prepared: dict) -> np.ndarray:
+        o = check.screen_object
+        crops = prepared.setdefault(id(check.group), {})
+        if "bgr" not in crops:
+            gx, gy, gw, gh = check.group.roi
+            crops["bgr"] = inp_img[gy:gy + gh, gx:gx + gw]
+
+        def sub(img):
+            x, y = check.offset
+            return img[y:y + check.roi[3], x:x + check.roi[2]]
+
+        if o.color_match:
+            if "hsv" not in crops:
+                with tracing.span("cvtColor", "convert", seq=getattr(inp_img, "seq", 0), roi=check.group.roi):
+                    crops["hsv"] = cv2.cvtColor(crops["bgr"], cv2.COLOR_BGR2HSV)
+            return color_filter(sub(crops["bgr"]), o.color_match, sub(crops["hsv"]))[1]
+        if o.use_grayscale:
+            if "gray" not in crops:
+                with tracing.span("cvtColor", "convert", seq=getattr(inp_img, "seq", 0), roi=check.group.roi):
+                    crops["gray"] = cv2.cvtColor(crops["bgr"], cv2.COLOR_BGR2GRAY)
+            return sub(crops["gray"])
+        return sub(crops["bgr"])
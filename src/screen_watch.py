@@ -0,0 +1,210 @@
+import time
+import threading
+from concurrent.futures import Future, InvalidStateError, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from functools import cache
+from loguru import logger
+
+from screen import Screen
+from ui_control import ScreenObject
+from template_finder import TemplateMatch
+from screen_state import ScreenState
+
+
+# extra seconds a blocking wait gives the watcher to resolve it after its timeout, e.g. to finish a running check
+RESULT_SLACK = 1.0
+
+
+@dataclass
+class Subscription:
+    screen_object: ScreenObject
+    # resolve once the object is visible, or once it is hidden
+    visible: bool
+    future: Future
+    callback: callable = None
+    deadline: float = None
+    # result of the last check made while this wait was registered
+    last: TemplateMatch = None
+
+
+class ScreenWatcher:
+    """
+    Resolves waits for ScreenObjects to appear or disappear. Every new frame is checked once for all ScreenObjects
+    that are waited for, in one ScreenState pass, no matter how many waits there are.
+    Frames come from Screen's capture thread if it runs, otherwise the watcher grabs them itself at poll_fps while
+    there are waits.
+    """
+
+    def __init__(self, poll_fps: float = 25):
+        self.screen = Screen()
+        self.poll_period = 1 / poll_fps
+        self.condition = threading.Condition()
+        self.subscriptions: list[Subscription] = []
+        self.frame = None
+        self.frame_seq = 0
+        self.checked_seq = 0
+        self._state = None
+        self._state_keys = None
+        self.thread = None
+        self.running = False
+
+    def watch(self, screen_object: ScreenObject, visible: bool = True, timeout: float = None,
+              callback=None) -> Future:
+        """
+        Register a wait. It is resolved on the first frame in which screen_object's visibility equals visible.
+        :param callback: Optional function(result) called on the watcher thread with the future's result when the
+        wait is resolved.
+        :return: Future with the TemplateMatch of the check that resolved the wait. On timeout, it is resolved with
+        the last check made during the wait, or None if screen_object was not checked at all. If checking
+        screen_object raises, e.g. because its roi or a template does not exist, the future gets that exception.
+        Await it with asyncio.wrap_future.
+        """
+        future = Future()
+        deadline = time.perf_counter() + timeout if timeout is not None else None
+        with self.condition:
+            self.subscriptions.append(Subscription(screen_object, visible, future, callback, deadline))
+            if not self.running:
+                self._start()
+            self.condition.notify_all()
+        return future
+
+    def wait_until_visible(self, screen_object: ScreenObject, timeout: float = 10.0) -> TemplateMatch:
+        """
+        :return: Valid TemplateMatch as soon as screen_object is visible, or an invalid one after timeout.
+        """
+        return self._wait(screen_object, True, timeout) or TemplateMatch()
+
+    def wait_until_hidden(self, screen_object: ScreenObject, timeout: float = 10.0) -> bool:
+        """
+        :return: True as soon as screen_object is not visible anymore. False after timeout, also if screen_object
+        could not be checked in time.
+        """
+        template_match = self._wait(screen_object, False, timeout)
+        return template_match is not None and not template_match.valid
+
+    def _wait(self, screen_object: ScreenObject, visible: bool, timeout: float) -> TemplateMatch | None:
+        future = self.watch(screen_object, visible, timeout)
+        try:
+            return future.result(None if timeout is None else timeout + RESULT_SLACK)
+        except FutureTimeoutError:
+            future.cancel()
+            return None
+
+    def _start(self):
+        self.running = True
+        self.screen.add_frame_listener(self._on_frame)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.screen.remove_frame_listener(self._on_frame)
+
+    def _on_frame(self, frame, seq: int):
+        # runs on the capturing thread, only hand the frame over
+        with self.condition:
+            self.frame, self.frame_seq = frame, seq
+            self.condition.notify_all()
+
+    def _next_frame(self):
+        """
+        Block until there is an unchecked frame and someone waiting for it, or the next deadline passed.
+        """
+        with self.condition:
+            while self.running:
+                if self.subscriptions and self.frame_seq > self.checked_seq:
+                    return self.frame, self.frame_seq
+                now = time.perf_counter()
+                deadlines = [s.deadline for s in self.subscriptions if s.deadline is not None]
+                if deadlines and min(deadlines) <= now:
+                    return None
+                wake = deadlines
+                if self.subscriptions and not self.screen.capture_running:
+                    next_poll = self.screen.rt_grab_time + self.poll_period
+                    if now >= next_poll:
+                        break
+                    wake = deadlines + [next_poll]
+                self.condition.wait(max(0.0, min(wake) - now) if wake else None)
+        if self.running:
+            # no capture thread, the grab publishes the frame through _on_frame
+            try:
+                return self.screen.grab_frame(require_new=True)
+            except Exception as e:
+                logger.warning(f"Screen watcher could not grab a frame: {e}")
+        return None
+
+    def _check(self, frame) -> tuple[dict[str, TemplateMatch], dict[str, Exception]]:
+        """
+        :return: (ScreenObject key -> TemplateMatch, ScreenObject key -> exception) of all ScreenObjects waited for.
+        """
+        with self.condition:
+            objects = {s.screen_object.key: s.screen_object for s in self.subscriptions}
+        if not objects:
+            return {}, {}
+        try:
+            if self._state_keys != set(objects):
+                self._state_keys = None
+                self._state = ScreenState(list(objects.values()))
+                self._state_keys = set(objects)
+            visible = self._state.classify(frame)
+            return {key: visible.get(key, TemplateMatch()) for key in objects}, {}
+        except Exception:
+            self._state_keys = None
+        # one broken ScreenObject must not fail the waits for all others, find out which one it is
+        results, errors = {}, {}
+        for key, screen_object in objects.items():
+            try:
+                results[key] = ScreenState([screen_object]).classify(frame).get(key, TemplateMatch())
+            except Exception as e:
+                logger.warning(f"Screen watcher could not check {key}: {e!r}")
+                errors[key] = e
+        return results, errors
+
+    def _resolve(self, results: dict[str, TemplateMatch], errors: dict[str, Exception]):
+        now = time.perf_counter()
+        done = []
+        with self.condition:
+            for s in self.subscriptions:
+                template_match = results.get(s.screen_object.key)
+                if template_match is not None:
+                    s.last = template_match
+                met = template_match is not None and template_match.valid == s.visible
+                if (met or s.screen_object.key in errors or s.future.done()
+                        or (s.deadline is not None and now >= s.deadline)):
+                    done.append(s)
+            finished = {id(s) for s in done}
+            self.subscriptions = [s for s in self.subscriptions if id(s) not in finished]
+        for s in done:
+            try:
+                if s.screen_object.key in errors:
+                    s.future.set_exception(errors[s.screen_object.key])
+                    continue
+                s.future.set_result(s.last)
+            except InvalidStateError:
+                # cancelled by the caller
+                continue
+            if s.callback is not None:
+                try:
+                    s.callback(s.last)
+                except Exception as e:
+                    logger.warning(f"Screen watcher callback failed: {e}")
+
+    def _run(self):
+        while self.running:
+            latest = self._next_frame()
+            results, errors = {}, {}
+            if latest is not None:
+                frame, seq = latest
+                results, errors = self._check(frame)
+                self.checked_seq = seq
+            self._resolve(results, errors)
+
+
+@cache
+def screen_watcher() -> ScreenWatcher:
+    return ScreenWatcher()
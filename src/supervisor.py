@@ -0,0 +1,368 @@
+"""
+Runs one bot worker process per game window on this host.
+
+    python supervisor.py <module>:<function>
+
+The supervisor owns the only screen capture and the only template matcher. It grabs every game window in turn,
+within a total frame budget (Config.supervisor), and publishes the frames to shared memory. Each worker reads the
+frames of its window through a SharedFrameSource behind its Screen. It sends ScreenObject checks to the supervisor
+through a MatchClient, so templates are only loaded once per host.
+"""
+import sys
+import time
+import queue
+import heapq
+import importlib
+import threading
+import multiprocessing
+import numpy as np
+from multiprocessing import shared_memory
+from loguru import logger
+
+from config import Config
+from screen import Screen
+from frame_source import FrameSource, LiveFrameSource
+from ui_control import ScreenObjects
+from window_tracker import WindowTracker
+from template_finder import TemplateMatch
+from parallel_matcher import ParallelMatcher
+
+# layout of the int64 header in front of every shared frame. seq is odd while the frame is being written.
+HEADER_SEQ, HEADER_LEFT, HEADER_TOP, HEADER_TIME = range(4)
+HEADER_FIELDS = 4
+
+
+class SharedFrameSlot:
+    """
+    Latest frame of one game window in shared memory, guarded by a sequence lock: a single writer, any number of
+    readers, and nobody ever blocks.
+    """
+
+    def __init__(self, shape: tuple[int, int, int], name: str = None):
+        self.shape = tuple(shape)
+        create = name is None
+        size = HEADER_FIELDS * 8 + int(np.prod(shape))
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size if create else 0)
+        self.owner = create
+        self.header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=self.shm.buf)
+        self.image = np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf, offset=HEADER_FIELDS * 8)
+        if create:
+            self.header[:] = 0
+
+    @property
+    def spec(self) -> tuple[str, tuple]:
+        """
+        :return: Arguments to attach to this slot from another process.
+        """
+        return self.shm.name, self.shape
+
+    @property
+    def seq(self) -> int:
+        return int(self.header[HEADER_SEQ]) // 2
+
+    def write(self, image: np.ndarray, origin: tuple[int, int]):
+        self.header[HEADER_SEQ] += 1
+        np.copyto(self.image, image)
+        self.header[HEADER_LEFT], self.header[HEADER_TOP] = origin
+        self.header[HEADER_TIME] = time.monotonic_ns()
+        self.header[HEADER_SEQ] += 1
+
+    def read_into(self, out: np.ndarray) -> tuple[int, tuple[int, int]]:
+        """
+        Copy the latest complete frame into out.
+        :return: (sequence number, screen position of the window) of the copied frame. Sequence 0 means nothing has
+        been captured yet.
+        """
+        while True:
+            before = int(self.header[HEADER_SEQ])
+            if before % 2:
+                time.sleep(0)
+                continue
+            np.copyto(out, self.image)
+            origin = int(self.header[HEADER_LEFT]), int(self.header[HEADER_TOP])
+            if int(self.header[HEADER_SEQ]) == before:
+                return before // 2, origin
+
+    def close(self):
+        self.header = self.image = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class SharedFrameSource(FrameSource):
+    """
+    Frame source of a bot worker, reading the frames the supervisor captured for its window. Screen.monitor follows
+    the window, so matches keep reporting correct monitor coordinates.
+    """
+    needs_window = False
+
+    def __init__(self, slot_spec: tuple[str, tuple], wait_timeout: float = 5.0):
+        self.slot = SharedFrameSlot(slot_spec[1], slot_spec[0])
+        self.wait_timeout = wait_timeout
+
+    def frame_shape(self, monitor: dict) -> tuple[int, int, int]:
+        return self.slot.shape
+
+    def grab(self, monitor: dict) -> np.ndarray:
+        out = np.empty(self.slot.shape, dtype=np.uint8)
+        self.grab_into(monitor, out)
+        return out
+
+    def grab_into(self, monitor: dict, out: np.ndarray):
+        end = time.perf_counter() + self.wait_timeout
+        while self.slot.seq == 0 and time.perf_counter() < end:
+            time.sleep(0.01)
+        _, (monitor["left"], monitor["top"]) = self.slot.read_into(out)
+
+    def close(self):
+        self.slot.close()
+
+
+class CaptureScheduler:
+    """
+    Splits a total frames per second budget between windows in proportion to their weight. next_due returns the
+    window whose next frame is most overdue.
+    """
+
+    def __init__(self, fps_budget: float):
+        self.fps_budget = fps_budget
+        self.weights = {}
+        self._due = []
+
+    def set_windows(self, windows: list[int]):
+        self.weights = {hwnd: self.weights.get(hwnd, 1.0) for hwnd in windows}
+        now = time.perf_counter()
+        due = {hwnd: t for t, hwnd in self._due if hwnd in self.weights}
+        self._due = [(due.get(hwnd, now), hwnd) for hwnd in self.weights]
+        heapq.heapify(self._due)
+
+    def set_weight(self, hwnd: int, weight: float):
+        if hwnd in self.weights:
+            self.weights[hwnd] = weight
+
+    def interval(self, hwnd: int) -> float:
+        total = sum(self.weights.values())
+        return total / (self.fps_budget * self.weights[hwnd]) if self.weights[hwnd] > 0 else float("inf")
+
+    def next_due(self) -> tuple[int | None, float]:
+        """
+        :return: (window to capture next, seconds until it is due). The window is None if there are none.
+        """
+        if not self._due:
+            return None, 1.0
+        due, hwnd = self._due[0]
+        return hwnd, max(0.0, due - time.perf_counter())
+
+    def captured(self, hwnd: int):
+        entry = next((entry for entry in self._due if entry[1] == hwnd), None)
+        if entry is None:
+            return
+        # windows may have been added since next_due, the captured one need not be on top anymore
+        self._due.remove(entry)
+        heapq.heapify(self._due)
+        due = entry[0]
+        # a late capture does not pull the following ones forward, otherwise one slow grab causes a burst
+        heapq.heappush(self._due, (max(due, time.perf_counter() - self.interval(hwnd)) + self.interval(hwnd), hwnd))
+
+
+class MatchClient:
+    """
+    Worker side of the supervisor's match service.
+    """
+
+    def __init__(self, client_id: int, requests: multiprocessing.Queue, responses: multiprocessing.Queue):
+        self.client_id = client_id
+        self.requests = requests
+        self.responses = responses
+        self._next_id = 0
+
+    def detect(self, screen_object_key: str, timeout: float = 2.0) -> TemplateMatch:
+        """
+        Check a ScreenObject on the latest frame the supervisor captured of this worker's window.
+        :param screen_object_key: Attribute name of the ScreenObject in ScreenObjects.
+        :return: TemplateMatch like detect_screen_object would return it. Invalid if the supervisor did not answer.
+        """
+        self._next_id += 1
+        self.requests.put((self.client_id, self._next_id, screen_object_key))
+        end = time.perf_counter() + timeout
+        while (remaining := end - time.perf_counter()) > 0:
+            try:
+                req_id, template_match = self.responses.get(timeout=remaining)
+            except queue.Empty:
+                break
+            # answers to requests that timed out earlier are dropped
+            if req_id == self._next_id:
+                return template_match
+        logger.warning(f"No match result for {screen_object_key} within {timeout}s")
+        return TemplateMatch()
+
+
+def _bot_worker(bot_target: str, slot_spec: tuple, client: MatchClient):
+    Screen().set_source(SharedFrameSource(slot_spec))
+    Screen().start()
+    module_name, function_name = bot_target.split(":")
+    getattr(importlib.import_module(module_name), function_name)(client)
+
+
+class Supervisor:
+    """
+    Discovers all game windows, captures them within one frame budget and runs a bot worker per window.
+    :param bot_target: "module:function" called in every worker with its MatchClient.
+    """
+
+    def __init__(self, bot_target: str, fps_budget: float = Config.supervisor['capture_fps_budget'],
+                 match_workers: int = None):
+        self.bot_target = bot_target
+        self.scheduler = CaptureScheduler(fps_budget)
+        self.matcher = ParallelMatcher(match_workers)
+        self.source = LiveFrameSource()
+        self.window_tracker = WindowTracker()
+        self.requests = multiprocessing.Queue()
+        self.shape = (Config.ui['window_height'], Config.ui['window_width'], 3)
+        # hwnd -> {slot, process, client_id, responses, grab_buffer, match_buffer}
+        self.instances = {}
+        self.clients = {}
+        self._next_client = 0
+        self.lock = threading.Lock()
+        self.running = False
+        self.threads = []
+
+    def discover(self):
+        """
+        Start workers for new game windows and stop the workers of closed ones.
+        """
+        windows = self.window_tracker.find_windows()
+        with self.lock:
+            closed = {hwnd: self._remove_instance(hwnd) for hwnd in set(self.instances) - set(windows)}
+            for hwnd in windows:
+                if hwnd not in self.instances:
+                    self._start_instance(hwnd)
+            self.scheduler.set_windows(list(self.instances))
+        # joining a worker can take seconds, capture and matching go on meanwhile
+        for hwnd, instance in closed.items():
+            self._stop_instance(hwnd, instance)
+
+    def _start_instance(self, hwnd: int):
+        self._next_client += 1
+        slot = SharedFrameSlot(self.shape)
+        responses = multiprocessing.Queue()
+        client = MatchClient(self._next_client, self.requests, responses)
+        process = multiprocessing.Process(target=_bot_worker, args=(self.bot_target, slot.spec, client), daemon=True)
+        # the capture thread grabs into grab_buffer, the match thread copies the slot into match_buffer
+        self.instances[hwnd] = {"slot": slot, "process": process, "client_id": client.client_id,
+                                "responses": responses, "grab_buffer": np.empty(self.shape, dtype=np.uint8),
+                                "match_buffer": np.empty(self.shape, dtype=np.uint8)}
+        self.clients[client.client_id] = hwnd
+        process.start()
+        logger.info(f"Started bot worker {client.client_id} for window {hwnd}")
+
+    def _remove_instance(self, hwnd: int) -> dict:
+        """
+        Forget the worker of hwnd, called with the lock held. The caller stops it with _stop_instance.
+        """
+        instance = self.instances.pop(hwnd)
+        del self.clients[instance["client_id"]]
+        return instance
+
+    def _stop_instance(self, hwnd: int, instance: dict):
+        instance["process"].terminate()
+        instance["process"].join(timeout=5)
+        instance["slot"].close()
+        logger.info(f"Stopped bot worker {instance['client_id']} for window {hwnd}")
+
+    def _capture_loop(self):
+        monitor = {"width": self.shape[1], "height": self.shape[0]}
+        while self.running:
+            with self.lock:
+                hwnd, wait = self.scheduler.next_due()
+            if hwnd is None or wait > 0:
+                time.sleep(min(wait, 0.05))
+                continue
+            with self.lock:
+                instance = self.instances.get(hwnd)
+            if instance is None:
+                continue
+            # grab without the lock, discover() and the match thread must not wait for it
+            try:
+                origin = self.window_tracker.api.client_rect(hwnd)[:2]
+                monitor["left"], monitor["top"] = origin
+                self.source.grab_into(monitor, instance["grab_buffer"])
+            except Exception as e:
+                # the window is probably closing, discover() removes it
+                logger.debug(f"Could not capture window {hwnd}: {e}")
+                origin = None
+            with self.lock:
+                # the worker may have been stopped during the grab, its slot is closed then
+                if self.instances.get(hwnd) is not instance:
+                    continue
+                if origin is not None:
+                    instance["slot"].write(instance["grab_buffer"], origin)
+                self.scheduler.captured(hwnd)
+
+    def _match_loop(self):
+        while self.running:
+            try:
+                pending = [self.requests.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            # answer everything queued so far with one detect_all per window
+            while True:
+                try:
+                    pending.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            by_window = {}
+            frames = {}
+            with self.lock:
+                for client_id, req_id, key in pending:
+                    hwnd = self.clients.get(client_id)
+                    if hwnd is not None:
+                        by_window.setdefault(hwnd, []).append((req_id, key))
+                # copied under the lock, so no slot is closed while it is read
+                for hwnd in by_window:
+                    instance = self.instances[hwnd]
+                    seq, origin = instance["slot"].read_into(instance["match_buffer"])
+                    frames[hwnd] = instance, seq, origin
+            for hwnd, requests in by_window.items():
+                instance, seq, origin = frames[hwnd]
+                if seq == 0:
+                    results = {}
+                else:
+                    objects = [getattr(ScreenObjects, key) for key in {key for _, key in requests}]
+                    results = self.matcher.detect_all(objects, instance["match_buffer"], origin)
+                for req_id, key in requests:
+                    instance["responses"].put((req_id, results.get(key, TemplateMatch())))
+
+    def _discover_loop(self):
+        while self.running:
+            self.discover()
+            time.sleep(Config.supervisor['discovery_interval'])
+
+    def start(self):
+        self.running = True
+        self.threads = [threading.Thread(target=fn, daemon=True)
+                        for fn in (self._discover_loop, self._capture_loop, self._match_loop)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+        with self.lock:
+            stopped = {hwnd: self._remove_instance(hwnd) for hwnd in list(self.instances)}
+        for hwnd, instance in stopped.items():
+            self._stop_instance(hwnd, instance)
+        self.matcher.close()
+        self.source.close()
+
+
+if __name__ == '__main__':
+    supervisor = Supervisor(sys.argv[1])
+    supervisor.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        supervisor.stop()
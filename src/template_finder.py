@@ -1,19 +1,36 @@
 import cv2
+import asyncio
 import threading
-from screen import Screen
-from dataclasses import dataclass
+from screen import Screen, convert_screen_to_monitor
+from dataclasses import dataclass, replace
 import numpy as np
 from loguru import logger
 import time
-import os
 from config import Config
+import tracing
 from functools import cache
-from copy import deepcopy
+from collections import OrderedDict
 
-from utils import list_files_in_folder, cut_roi, roi_center, mask_by_roi
+from template_store import open_store, alpha_to_mask, orb_features, VARIANTS, TEMPLATE_STORE_PATH
+from ui_control import ScreenObject, ScreenObjects
+import resolution
+from utils import cut_roi, roi_center, mask_by_roi
 
 templates_lock = threading.Lock()
 
+# id(ScreenObject) -> (frame_seq, resolution.layout(), TemplateMatch) of the last detection on a Screen frame
+_last_detections = {}
+
+# ScreenObject key -> (frame_seq, time.perf_counter() when recorded, TemplateMatch) of the newest result from any
+# detector, see record_detection
+_detection_cache = {}
+
+# roi names referenced by a ScreenObject but missing from Config.ui_roi, warned about once
+_missing_rois = set()
+
+# id(ScreenObject) -> TrackState of ScreenObjects followed by track_screen_object
+_tracks = {}
+
 TEMPLATE_PATHS = [
     "data\\templates",
     "data\\npc",
@@ -23,6 +40,33 @@ TEMPLATE_PATHS = [
     "data\\gamble",
 ]
 
+# coarse-to-fine search: number of pyrDown steps for the coarse pass, how many coarse peaks are refined at full
+# resolution, and the smallest template side (in coarse pixels) for which the coarse pass is still meaningful
+PYRAMID_LEVELS = 2
+PYRAMID_CANDIDATES = 3
+PYRAMID_MIN_TEMPLATE_SIZE = 6
+
+# feature matching: keypoints detected per pixel of a frame roi (too few and small templates lose their keypoints
+# to busier areas), Lowe's ratio for descriptor matches, the fewest matches a template position is estimated from,
+# and the slack in pixels around it for the correlation check
+FRAME_FEATURE_DENSITY = 1 / 200
+FEATURE_RATIO = 0.75
+FEATURE_MIN_MATCHES = 4
+FEATURE_VERIFY_MARGIN = 4
+FEATURE_SCALE_SNAP = 0.02
+
+# find_all: boxes overlapping a better match by more than this intersection over union are dropped
+FIND_ALL_MAX_OVERLAP = 0.3
+
+# calibrate_scale tries these factors around the scale derived from the frame size
+CALIBRATION_STEPS = (0.9, 0.95, 1.0, 1.05, 1.1)
+
+# tracking: margin around the last match that is searched first, and the number of consecutive frames on which the
+# object was not found within that margin (each doubling it) after which the search starts with the whole roi again
+TRACKING_MARGIN = 24
+TRACKING_MAX_MISSES = 3
+
+
 
 @dataclass
 class Template:
@@ -31,6 +75,17 @@ class Template:
     img_bgr: np.ndarray = None
     img_gray: np.ndarray = None
     alpha_mask: np.ndarray = None
+    orb_keypoints: np.ndarray = None
+    orb_descriptors: np.ndarray = None
+    # ui scale the images were resized to, see resolution
+    scale: float = 1.0
+
+
+@dataclass
+class TrackState:
+    region: list[int]
+    margin: int = TRACKING_MARGIN
+    misses: int = 0
 
 
 @dataclass
@@ -44,108 +99,270 @@ class TemplateMatch:
     valid: bool = False
 
 
-def load_template(path):
-    if os.path.isfile(path):
-        try:
-            template_img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
-            return template_img
-        except Exception as e:
-            print(e)
-            raise ValueError(f"Could not load template: {path}")
-    else:
-        logger.error(f"Template does not exist: {path}")
-    return None
-
-
-def alpha_to_mask(img: np.ndarray):
-    # create a mask from template where alpha == 0
-    if img.shape[2] == 4:
-        if np.min(img[:, :, 3]) == 0:
-            _, mask = cv2.threshold(img[:, :, 3], 1, 255, cv2.THRESH_BINARY)
-            return mask
-    return None
-
-
-def color_filter(img, color_range):
-    color_ranges = []
-    # ex: [array([ -9, 201,  25]), array([ 9, 237,  61])]
-    if color_range[0][0] < 0:
-        lower_range = deepcopy(color_range)
-        lower_range[0][0] = 0
-        color_ranges.append(lower_range)
-        upper_range = deepcopy(color_range)
-        upper_range[0][0] = 180 + color_range[0][0]
-        upper_range[1][0] = 180
-        color_ranges.append(upper_range)
-    # ex: [array([ 170, 201,  25]), array([ 188, 237,  61])]
-    elif color_range[1][0] > 180:
-        upper_range = deepcopy(color_range)
-        upper_range[1][0] = 180
-        color_ranges.append(upper_range)
-        lower_range = deepcopy(color_range)
-        lower_range[0][0] = 0
-        lower_range[1][0] = color_range[1][0] - 180
-        color_ranges.append(lower_range)
-    else:
-        color_ranges.append(color_range)
-    color_masks = []
-    for color_range in color_ranges:
+def _normalize_color_range(color_range) -> tuple[int, ...]:
+    # accepts Config.colors entries (h_min, s_min, v_min, h_max, s_max, v_max) as well as [lower, upper] hsv arrays
+    return tuple(int(v) for v in np.asarray(color_range).reshape(-1))
+
+
+@cache
+def _color_lut(color_range: tuple[int, ...]) -> np.ndarray:
+    """
+    Per channel lookup table (1x256x3) that maps an hsv value to 255 if it lies within color_range. Hue ranges
+    below 0 or above 180 wrap around, e.g. red (-9, ..., 12, ...) covers hue 171-180 and 0-12.
+    """
+    h_min, s_min, v_min, h_max, s_max, v_max = color_range
+    values = np.arange(256)
+    hue = np.zeros(256, dtype=bool)
+    for offset in (-180, 0, 180):
+        hue |= (values + offset >= h_min) & (values + offset <= h_max)
+    lut = np.stack([
+        hue,
+        (values >= s_min) & (values <= s_max),
+        (values >= v_min) & (values <= v_max),
+    ], axis=-1)
+    return (lut * 255).astype(np.uint8).reshape(1, 256, 3)
+
+
+@cache
+def _color_bits_lut(color_names: tuple[str, ...]) -> np.ndarray:
+    """
+    Bit-packed lookup table (3x256) over up to 32 Config.colors entries: bit i of lut[c][v] is set if value v of
+    hsv channel c lies within the range of color_names[i].
+    """
+    if len(color_names) > 32:
+        raise ValueError("At most 32 colors can be classified in one pass")
+    lut = np.zeros((3, 256), dtype=np.uint32)
+    for i, name in enumerate(color_names):
+        lut |= (_color_lut(_normalize_color_range(Config.colors[name]))[0].T > 0).astype(np.uint32) << np.uint32(i)
+    return lut
+
+
+# (frame_seq, roi, conversion) -> converted roi crop of a screen Frame
+_conversion_cache = OrderedDict()
+_conversion_cache_lock = threading.Lock()
+CONVERSION_CACHE_SIZE = 64
+
+
+def convert_roi(inp_img: np.ndarray, roi: list = None, code: int = cv2.COLOR_BGR2HSV) -> np.ndarray:
+    """
+    Crop inp_img to roi and apply cv2.cvtColor with code. For Frames grabbed by Screen, the result is cached per
+    frame_seq and roi, so several checks on the same frame share one conversion.
+    """
+    if roi is None:
+        roi = [0, 0, inp_img.shape[1], inp_img.shape[0]]
+    rx, ry, rw, rh = roi
+    seq = getattr(inp_img, "seq", 0)
+    key = (seq, rx, ry, rw, rh, code)
+    if seq:
+        with _conversion_cache_lock:
+            if key in _conversion_cache:
+                return _conversion_cache[key]
+    with tracing.span("cvtColor", "convert", seq=seq, roi=roi, code=code):
+        converted = cv2.cvtColor(inp_img[ry:ry + rh, rx:rx + rw], code)
+    if seq:
+        with _conversion_cache_lock:
+            _conversion_cache[key] = converted
+            while len(_conversion_cache) > CONVERSION_CACHE_SIZE:
+                _conversion_cache.popitem(last=False)
+    return converted
+
+
+# (frame_seq, roi) -> (keypoint positions in roi coordinates, descriptors) of a screen Frame
+_feature_cache = OrderedDict()
+FEATURE_CACHE_SIZE = 16
+
+
+def frame_features(inp_img: np.ndarray, roi: list = None) -> tuple[np.ndarray | None, np.ndarray | None]:
+    """
+    ORB keypoints of inp_img within roi. For Frames grabbed by Screen, they are computed once per frame_seq and roi
+    and shared by all templates matched there.
+    :return: (N x 2 float32 keypoint positions relative to roi, N x 32 descriptors), both None without keypoints.
+    """
+    if roi is None:
+        roi = [0, 0, inp_img.shape[1], inp_img.shape[0]]
+    seq = getattr(inp_img, "seq", 0)
+    key = (seq, *roi)
+    if seq:
+        with _conversion_cache_lock:
+            if key in _feature_cache:
+                return _feature_cache[key]
+    gray = convert_roi(inp_img, roi, cv2.COLOR_BGR2GRAY)
+    with tracing.span("orb", "convert", seq=seq, roi=roi):
+        keypoints, descriptors = orb_features(gray, features=max(500, int(gray.size * FRAME_FEATURE_DENSITY)))
+    features = (keypoints[:, :2] if keypoints is not None else None, descriptors)
+    if seq:
+        with _conversion_cache_lock:
+            _feature_cache[key] = features
+            while len(_feature_cache) > FEATURE_CACHE_SIZE:
+                _feature_cache.popitem(last=False)
+    return features
+
+
+def color_filter(img, color_range, hsv_img: np.ndarray = None):
+    """
+    :param img: BGR image.
+    :param color_range: Config.colors entry or [lower, upper] hsv range.
+    :param hsv_img: img converted to hsv, if already available.
+    :return: Mask of the pixels within color_range and img with all other pixels set to 0.
+    """
+    if hsv_img is None:
         hsv_img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        mask = cv2.inRange(hsv_img, color_range[0], color_range[1])
-        color_masks.append(mask)
-    color_mask = np.bitwise_or.reduce(color_masks) if len(color_masks) > 0 else color_masks[0]
+    h, s, v = cv2.split(cv2.LUT(hsv_img, _color_lut(_normalize_color_range(color_range))))
+    color_mask = cv2.bitwise_and(cv2.bitwise_and(h, s), v)
     filtered_img = cv2.bitwise_and(img, img, mask=color_mask)
     return color_mask, filtered_img
 
 
+def color_masks(hsv_img: np.ndarray, color_names: list[str] = None) -> dict[str, np.ndarray]:
+    """
+    Classify every pixel of an hsv image against several Config.colors entries in a single pass.
+    :param hsv_img: Hsv image, e.g. from convert_roi.
+    :param color_names: Keys of Config.colors. Defaults to all of them.
+    :return: Color name -> mask of the pixels within that color's range.
+    """
+    color_names = tuple(color_names if color_names is not None else Config.colors.keys())
+    masks = {}
+    for start in range(0, len(color_names), 32):
+        names = color_names[start:start + 32]
+        lut = _color_bits_lut(names)
+        bits = lut[0][hsv_img[:, :, 0]] & lut[1][hsv_img[:, :, 1]] & lut[2][hsv_img[:, :, 2]]
+        for i, name in enumerate(names):
+            masks[name] = ((bits >> np.uint32(i)) & 1).astype(np.uint8) * 255
+    return masks
+
+
+class TemplateRegistry:
+    """
+    Named templates from the memory-mapped template store. Unscaled variants are views into the store and only cost
+    page cache. Variants resized to another ui scale are copies owned by the registry, the least recently used are
+    dropped once their total size exceeds the memory budget.
+    """
+
+    def __init__(self, folders: list[str], memory_budget: int, store_path: str = TEMPLATE_STORE_PATH):
+        self.folders = folders
+        self.memory_budget = memory_budget
+        self.store_path = store_path
+        self._store = None
+        self._variants = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def store(self):
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    self._store = open_store(self.folders, self.store_path)
+        return self._store
+
+    def keys(self):
+        return self.store.keys()
+
+    def __contains__(self, key: str):
+        return key in self.store
+
+    def __getitem__(self, key: str) -> Template:
+        return self.get(key)
+
+    def variant(self, key: str, variant: str, scale: float = 1.0) -> np.ndarray | None:
+        """
+        :param scale: ui scale to resize image variants to. Scaled variants are cached and count against the memory
+        budget. Keypoint variants are scale invariant and never resized.
+        """
+        if variant in ("orb_keypoints", "orb_descriptors"):
+            scale = 1.0
+        if scale == 1.0:
+            # a view into the memory-mapped store, its pages belong to the os page cache and not to this registry
+            return self.store.variant(key, variant)
+        cache_key = (key, variant, scale)
+        with self._lock:
+            if cache_key in self._variants:
+                self._variants.move_to_end(cache_key)
+                return self._variants[cache_key]
+        img = self.store.variant(key, variant)
+        if img is not None:
+            img = resolution.scale_image(img, scale, is_mask=variant == "alpha_mask")
+        with self._lock:
+            # another thread may have resized the same variant in the meantime
+            if cache_key in self._variants:
+                self._variants.move_to_end(cache_key)
+                return self._variants[cache_key]
+            self._variants[cache_key] = img
+            self._size += img.nbytes if img is not None else 0
+            self._evict()
+        return img
+
+    def get(self, key: str, variants: tuple[str, ...] = VARIANTS, scale: float = 1.0) -> Template:
+        return Template(name=key, scale=scale, **{v: self.variant(key, v, scale) for v in variants})
+
+    def memory_usage(self) -> int:
+        return self._size
+
+    def _evict(self):
+        # always keep the most recent variant, even if it alone exceeds the budget
+        while self._size > self.memory_budget and len(self._variants) > 1:
+            _, img = self._variants.popitem(last=False)
+            self._size -= img.nbytes if img is not None else 0
+
+
 @cache
-def stored_templates():
-    paths = []
-    templates = {}
-    for path in TEMPLATE_PATHS:
-        paths += list_files_in_folder(path)
-    for file_path in paths:
-        file_name: str = os.path.basename(file_path)
-        if file_name.lower().endswith('.png'):
-            key = file_name[:-4].upper()
-            template_img = load_template(file_path)
-            templates[key] = Template(
-                name=key,
-                img_bgra=template_img,
-                img_bgr=cv2.cvtColor(template_img, cv2.COLOR_BGRA2BGR),
-                img_gray=cv2.cvtColor(template_img, cv2.COLOR_BGRA2GRAY),
-                alpha_mask=alpha_to_mask(template_img)
-            )
-    return templates
+def stored_templates() -> TemplateRegistry:
+    return TemplateRegistry(TEMPLATE_PATHS, Config.templates['memory_budget_mb'] * 1024 * 1024)
 
 
 def get_template(key):
     with templates_lock:
-        return stored_templates()[key].img_bgr
+        return stored_templates().variant(key, "img_bgr")
 
 
-def _process_template_refs(name: str | np.ndarray | list[str]) -> list[Template]:
+def _used_variants(color_match: list = None, use_grayscale: bool = False,
+                   use_features: bool = False) -> tuple[str, ...]:
+    if use_features:
+        return "img_gray", "alpha_mask", "orb_keypoints", "orb_descriptors"
+    if use_grayscale and not color_match:
+        return "img_gray", "alpha_mask"
+    return "img_bgr", "alpha_mask"
+
+
+def _process_template_refs(name: str | np.ndarray | list[str], color_match: list = None, use_grayscale: bool = False,
+                           use_features: bool = False) -> list[Template]:
     templates = []
     if type(name) != list:
         name = [name]
+    variants = _used_variants(color_match, use_grayscale, use_features)
     for i in name:
         # if the reference is a string, then it's a reference to a named template asset
         if type(i) == str:
-            templates.append(stored_templates()[i.upper()])
+            templates.append(stored_templates().get(i.upper(), variants, resolution.current_scale()))
         # if the reference is an image, append new Template class object
         elif type(i) == np.ndarray:
-            templates.append(Template(
+            template = Template(
                 img_bgr=i,
                 img_gray=cv2.cvtColor(i, cv2.COLOR_BGR2GRAY),
                 alpha_mask=alpha_to_mask(i)
-            ))
+            )
+            if use_features:
+                template.orb_keypoints, template.orb_descriptors = orb_features(template.img_gray, template.alpha_mask)
+            templates.append(template)
     return templates
 
 
-def _single_template_match(template: Template, inp_img: np.ndarray = None, roi: list = None, color_match: list = None, use_grayscale: bool = False) -> TemplateMatch:
-    inp_img = inp_img if inp_img is not None else Screen().grab()
-    template_match = TemplateMatch()
+def _resolve_roi(screen_object: ScreenObject) -> list | None:
+    """
+    :return: The roi of screen_object at the current ui scale. None (the whole frame) if it has none, or if its
+    roi_name is missing from Config.ui_roi.
+    """
+    if screen_object.roi_name is None:
+        return None
+    roi = resolution.roi_table().get(screen_object.roi_name)
+    if roi is None and screen_object.roi_name not in _missing_rois:
+        _missing_rois.add(screen_object.roi_name)
+        logger.warning(f"Roi {screen_object.roi_name} of {screen_object.key} is not in Config.ui_roi, searching the "
+                       f"whole frame instead")
+    return roi
 
+
+def _crop_and_convert(inp_img: np.ndarray, roi: list = None, color_match: list = None, use_grayscale: bool = False):
     # crop image to roi
     if roi is None:
         # if no roi is provided roi = full inp_img
@@ -155,33 +372,498 @@ def _single_template_match(template: Template, inp_img: np.ndarray = None, roi:
 
     # filter for desired color or make grayscale
     if color_match:
-        template_img,  = color_filter(template.img_bgr, color_match)[1],
-        img = color_filter(img, color_match)[1]
+        img = color_filter(img, color_match, convert_roi(inp_img, roi, cv2.COLOR_BGR2HSV))[1]
     elif use_grayscale:
-        template_img = template.img_gray
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    else:
-        template_img = template.img_bgr
+        img = convert_roi(inp_img, roi, cv2.COLOR_BGR2GRAY)
+    return img, roi
+
+
+# (template name, scale, color range) -> color filtered template image
+_filtered_templates = {}
+
+
+def _template_image(template: Template, color_match: list = None, use_grayscale: bool = False) -> np.ndarray:
+    if color_match:
+        if template.name is None:
+            return color_filter(template.img_bgr, color_match)[1]
+        key = (template.name, template.scale, _normalize_color_range(color_match))
+        if key not in _filtered_templates:
+            _filtered_templates[key] = color_filter(template.img_bgr, color_match)[1]
+        return _filtered_templates[key]
+    elif use_grayscale:
+        return template.img_gray
+    return template.img_bgr
+
+
+def _full_match(img: np.ndarray, template_img: np.ndarray, mask: np.ndarray = None) -> tuple[float, tuple[int, int]]:
+    res = cv2.matchTemplate(img, template_img, cv2.TM_CCOEFF_NORMED, mask=mask)
+    np.nan_to_num(res, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+    _, max_val, _, max_pos = cv2.minMaxLoc(res)
+    return max_val, max_pos
+
+
+def _pyramid_match(img: np.ndarray, template_img: np.ndarray, mask: np.ndarray = None) -> tuple[float, tuple[int, int]]:
+    """
+    Coarse-to-fine search: match a downscaled template on a downscaled image, then refine the best coarse candidates
+    in small full resolution windows. Falls back to a full match if the template is too small to be downscaled.
+    """
+    scale = 2 ** PYRAMID_LEVELS
+    th, tw = template_img.shape[:2]
+    if min(th, tw) // scale < PYRAMID_MIN_TEMPLATE_SIZE:
+        return _full_match(img, template_img, mask)
 
+    small_img, small_template = img, template_img
+    for _ in range(PYRAMID_LEVELS):
+        small_img = cv2.pyrDown(small_img)
+        small_template = cv2.pyrDown(small_template)
+    small_mask = None
+    if mask is not None:
+        small_mask = cv2.resize(mask, (small_template.shape[1], small_template.shape[0]), interpolation=cv2.INTER_NEAREST)
+    res = cv2.matchTemplate(small_img, small_template, cv2.TM_CCOEFF_NORMED, mask=small_mask)
+    np.nan_to_num(res, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+
+    # pyrDown blurs and rounds sizes, so a coarse peak is only accurate to about one coarse pixel
+    margin = 2 * scale
+    sh, sw = small_template.shape[0] // 2, small_template.shape[1] // 2
+    best_val, best_pos = -1.0, (0, 0)
+    for _ in range(PYRAMID_CANDIDATES):
+        _, _, _, (cx, cy) = cv2.minMaxLoc(res)
+        x0, y0 = max(0, cx * scale - margin), max(0, cy * scale - margin)
+        x1, y1 = min(img.shape[1], cx * scale + tw + margin), min(img.shape[0], cy * scale + th + margin)
+        if y1 - y0 >= th and x1 - x0 >= tw:
+            val, pos = _full_match(img[y0:y1, x0:x1], template_img, mask)
+            if val > best_val:
+                best_val, best_pos = val, (pos[0] + x0, pos[1] + y0)
+        # suppress the neighbourhood of this candidate so the next iteration picks a different peak
+        res[max(0, cy - sh):cy + sh + 1, max(0, cx - sw):cx + sw + 1] = -1.0
+    return best_val, best_pos
+
+
+def _match_prepared(template: Template, img: np.ndarray, template_img: np.ndarray, roi: list,
+                    use_pyramid: bool = False) -> TemplateMatch:
+    """
+    Match a template against an image that has already been cropped to roi and color converted.
+    """
+    template_match = TemplateMatch()
     if not (img.shape[0] > template_img.shape[0] and img.shape[1] > template_img.shape[1]):
         logger.error(f"Image shape and template shape are incompatible: {template.name}. Image: {img.shape}, Template: {template_img.shape}, roi: {roi}")
     else:
-        res = cv2.matchTemplate(img, template_img, cv2.TM_CCOEFF_NORMED, mask = template.alpha_mask)
+        rx, ry, _, _ = roi
+        if use_pyramid:
+            max_val, max_pos = _pyramid_match(img, template_img, template.alpha_mask)
+        else:
+            max_val, max_pos = _full_match(img, template_img, template.alpha_mask)
+
+        template_match = _template_match_at(template.name, max_val, max_pos[0] + rx, max_pos[1] + ry,
+                                            template_img.shape[1], template_img.shape[0])
+
+    return template_match
+
+
+def _template_match_at(name: str, score: float, x: int, y: int, w: int, h: int) -> TemplateMatch:
+    # save rectangle corresponding to matched region
+    template_match = TemplateMatch()
+    template_match.region = [int(x), int(y), int(w), int(h)]
+    template_match.region_monitor = [*convert_screen_to_monitor((int(x), int(y))), int(w), int(h)]
+    template_match.center = roi_center(template_match.region)
+    template_match.center_monitor = convert_screen_to_monitor(template_match.center)
+    template_match.name = name
+    template_match.score = score
+    template_match.valid = True
+    return template_match
+
+
+def _single_template_match(template: Template, inp_img: np.ndarray = None, roi: list = None, color_match: list = None, use_grayscale: bool = False, use_pyramid: bool = False) -> TemplateMatch:
+    inp_img = inp_img if inp_img is not None else Screen().grab()
+    img, roi = _crop_and_convert(inp_img, roi, color_match, use_grayscale)
+    template_img = _template_image(template, color_match, use_grayscale)
+    return _match_prepared(template, img, template_img, roi, use_pyramid)
+
+
+def _feature_match(template: Template, inp_img: np.ndarray, roi: list = None) -> TemplateMatch:
+    """
+    Locate template by its ORB descriptors, at any scale, then score the located region by correlation so scores
+    compare to those of the other matchers. Templates with too few keypoints are matched by correlation instead.
+    """
+    if roi is None:
+        roi = [0, 0, inp_img.shape[1], inp_img.shape[0]]
+    if template.orb_descriptors is None or len(template.orb_descriptors) < FEATURE_MIN_MATCHES:
+        return _single_template_match(template, inp_img, roi, use_grayscale=True)
+    points, descriptors = frame_features(inp_img, roi)
+    if descriptors is None or len(descriptors) < 2:
+        return TemplateMatch()
+
+    pairs = cv2.BFMatcher(cv2.NORM_HAMMING).knnMatch(template.orb_descriptors, descriptors, k=2)
+    good = [p[0] for p in pairs if len(p) == 2 and p[0].distance < FEATURE_RATIO * p[1].distance]
+    if len(good) < FEATURE_MIN_MATCHES:
+        return TemplateMatch()
+    src = template.orb_keypoints[[m.queryIdx for m in good], :2]
+    dst = points[[m.trainIdx for m in good]]
+    transform, _ = cv2.estimateAffinePartial2D(src, dst, method=cv2.RANSAC, ransacReprojThreshold=3.0)
+    if transform is None:
+        return TemplateMatch()
+
+    # position and scale of the template in the roi, rotation is ignored. Keypoints are those of the unscaled
+    # template, so the scale already includes the ui scale.
+    scale = float(np.hypot(transform[0, 0], transform[1, 0]))
+    x, y = transform[:, 2]
+    if abs(scale - template.scale) < FEATURE_SCALE_SNAP:
+        # keypoint positions are only accurate to about a pixel, which shows as a slight scale on large templates
+        template_img, mask = template.img_gray, template.alpha_mask
+    else:
+        template_img, mask = _unscaled_gray(template)
+        th, tw = template_img.shape[:2]
+        w, h = round(tw * scale), round(th * scale)
+        if w < 2 or h < 2:
+            return TemplateMatch()
+        template_img = cv2.resize(template_img, (w, h))
+        if mask is not None:
+            mask = cv2.resize(mask, (w, h), interpolation=cv2.INTER_NEAREST)
+    h, w = template_img.shape[:2]
+
+    gray = convert_roi(inp_img, roi, cv2.COLOR_BGR2GRAY)
+    x0, y0 = max(0, int(x) - FEATURE_VERIFY_MARGIN), max(0, int(y) - FEATURE_VERIFY_MARGIN)
+    x1 = min(gray.shape[1], int(x) + w + FEATURE_VERIFY_MARGIN)
+    y1 = min(gray.shape[0], int(y) + h + FEATURE_VERIFY_MARGIN)
+    if x1 - x0 < w or y1 - y0 < h:
+        return TemplateMatch()
+    max_val, max_pos = _full_match(gray[y0:y1, x0:x1], template_img, mask)
+    return _template_match_at(template.name, max_val, roi[0] + x0 + max_pos[0], roi[1] + y0 + max_pos[1], w, h)
+
+
+def _unscaled_gray(template: Template) -> tuple[np.ndarray, np.ndarray | None]:
+    # img_gray and alpha_mask of template at ui scale 1.0, the size its keypoints were detected at
+    if template.scale == 1.0 or template.name is None:
+        return template.img_gray, template.alpha_mask
+    registry = stored_templates()
+    return registry.variant(template.name, "img_gray"), registry.variant(template.name, "alpha_mask")
+
+
+def _search_features(templates: list[Template], inp_img: np.ndarray, roi: list, threshold: float,
+                     best_match: bool = False) -> TemplateMatch:
+    best = TemplateMatch()
+    for template in templates:
+        template_match = _feature_match(template, inp_img, roi)
+        if not template_match.valid or template_match.score < threshold:
+            continue
+        if not best_match:
+            return template_match
+        if template_match.score > best.score:
+            best = template_match
+    return best
+
+
+def search(ref: str | np.ndarray | list[str], inp_img: np.ndarray = None, threshold: float = 0.68, roi: list = None,
+           color_match: list = None, use_grayscale: bool = False, best_match: bool = False,
+           use_pyramid: bool = False, use_features: bool = False) -> TemplateMatch:
+    """
+    Match a group of templates against one frame. The roi crop and the color conversion of the frame are done once
+    and shared by all templates.
+    :param ref: Template name(s) or image(s).
+    :param inp_img: Frame to search in. If None, a screenshot is taken.
+    :param threshold: Minimum score for a match to be valid.
+    :param roi: [x, y, w, h] region of inp_img to search in. If None, the whole frame is searched.
+    :param color_match: HSV color range both frame and templates are filtered with.
+    :param use_grayscale: Match on grayscale images instead of BGR.
+    :param best_match: If False, return the first template above threshold. Otherwise, match all templates and
+    return the one with the highest score.
+    :param use_pyramid: Use the coarse-to-fine pyramid search. Meant for large (e.g. full frame) search areas.
+    :param use_features: Locate templates by ORB keypoints instead of sliding them over the frame, which also finds
+    them at other scales. Matching is done in grayscale, color_match and use_pyramid are ignored.
+    :return: TemplateMatch. valid is False if no template scores above threshold.
+    """
+    templates = _process_template_refs(ref, color_match, use_grayscale, use_features)
+    inp_img = inp_img if inp_img is not None else Screen().grab()
+    if use_features:
+        return _search_features(templates, inp_img, roi, threshold, best_match)
+    img, roi = _crop_and_convert(inp_img, roi, color_match, use_grayscale)
+    return _search_prepared(templates, img, roi, threshold, color_match, use_grayscale, best_match, use_pyramid)
+
+
+def _search_prepared(templates: list[Template], img: np.ndarray, roi: list, threshold: float, color_match: list = None,
+                     use_grayscale: bool = False, best_match: bool = False, use_pyramid: bool = False) -> TemplateMatch:
+    """
+    search() on an image that has already been cropped to roi and color converted.
+    """
+    best = TemplateMatch()
+    for template in templates:
+        template_img = _template_image(template, color_match, use_grayscale)
+        template_match = _match_prepared(template, img, template_img, roi, use_pyramid)
+        if not template_match.valid or template_match.score < threshold:
+            continue
+        if not best_match:
+            return template_match
+        if template_match.score > best.score:
+            best = template_match
+    return best
+
+
+def _local_peaks(res: np.ndarray, threshold: float, template_size: tuple[int, int]) -> tuple[np.ndarray, ...]:
+    """
+    :return: (scores, xs, ys) of all local maxima of a matchTemplate result above threshold. A peak has to be the
+    maximum of a neighbourhood of half the template size.
+    """
+    tw, th = template_size
+    kernel = np.ones((max(3, th // 2 | 1), max(3, tw // 2 | 1)), dtype=np.uint8)
+    peaks = (res >= threshold) & (res == cv2.dilate(res, kernel))
+    ys, xs = np.nonzero(peaks)
+    return res[ys, xs], xs, ys
+
+
+def _non_max_suppression(boxes: np.ndarray, scores: np.ndarray, max_overlap: float) -> np.ndarray:
+    """
+    Greedy non-maximum suppression, each step drops all remaining boxes overlapping the best one at once.
+    :param boxes: N x 4 [x, y, w, h]
+    :return: Indices of the kept boxes, best first.
+    """
+    x0, y0 = boxes[:, 0], boxes[:, 1]
+    x1, y1 = x0 + boxes[:, 2], y0 + boxes[:, 3]
+    areas = boxes[:, 2] * boxes[:, 3]
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while order.size:
+        i, rest = order[0], order[1:]
+        keep.append(i)
+        w = np.clip(np.minimum(x1[i], x1[rest]) - np.maximum(x0[i], x0[rest]), 0, None)
+        h = np.clip(np.minimum(y1[i], y1[rest]) - np.maximum(y0[i], y0[rest]), 0, None)
+        intersection = w * h
+        iou = intersection / (areas[i] + areas[rest] - intersection)
+        order = rest[iou <= max_overlap]
+    return np.array(keep, dtype=int)
+
+
+def find_all(ref: str | np.ndarray | list[str], inp_img: np.ndarray = None, threshold: float = 0.68, roi: list = None,
+             color_match: list = None, use_grayscale: bool = False,
+             max_overlap: float = FIND_ALL_MAX_OVERLAP) -> list[TemplateMatch]:
+    """
+    Find every occurrence of a group of templates, e.g. all empty stash slots, with one matchTemplate per template.
+    Parameters are the same as for search.
+    :param max_overlap: Matches overlapping a better one (of any template) by more than this IoU are dropped.
+    :return: TemplateMatch of every occurrence above threshold, best first.
+    """
+    templates = _process_template_refs(ref, color_match, use_grayscale)
+    inp_img = inp_img if inp_img is not None else Screen().grab()
+    img, roi = _crop_and_convert(inp_img, roi, color_match, use_grayscale)
+    names, boxes, scores = [], [], []
+    for template in templates:
+        template_img = _template_image(template, color_match, use_grayscale)
+        th, tw = template_img.shape[:2]
+        if not (img.shape[0] > th and img.shape[1] > tw):
+            logger.error(f"Image shape and template shape are incompatible: {template.name}. Image: {img.shape}, Template: {template_img.shape}, roi: {roi}")
+            continue
+        res = cv2.matchTemplate(img, template_img, cv2.TM_CCOEFF_NORMED, mask=template.alpha_mask)
         np.nan_to_num(res, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
-        _, max_val, _, max_pos = cv2.minMaxLoc(res)
-
-        # save rectangle corresponding to matched region
-        rec_x = int((max_pos[0] + rx))
-        rec_y = int((max_pos[1] + ry))
-        rec_w = int(template_img.shape[1])
-        rec_h = int(template_img.shape[0])
-        template_match.region = [rec_x, rec_y, rec_w, rec_h]
-        template_match.region_monitor = [*convert_screen_to_monitor((rec_x, rec_y)), rec_w, rec_h]
-        template_match.center = roi_center(template_match.region)
-        template_match.center_monitor = convert_screen_to_monitor(template_match.center)
-        template_match.name = template.name
-        template_match.score = max_val
-        template_match.valid = True
+        peak_scores, xs, ys = _local_peaks(res, threshold, (tw, th))
+        names += [template.name] * len(xs)
+        boxes.append(np.stack([xs + roi[0], ys + roi[1], np.full_like(xs, tw), np.full_like(xs, th)], axis=1))
+        scores.append(peak_scores)
+    if not names:
+        return []
+    boxes, scores = np.concatenate(boxes), np.concatenate(scores)
+    return [_template_match_at(names[i], float(scores[i]), *boxes[i].tolist())
+            for i in _non_max_suppression(boxes, scores, max_overlap)]
+
+
+def find_all_screen_object(screen_object: ScreenObject, inp_img: np.ndarray = None) -> list[TemplateMatch]:
+    """
+    find_all with the templates, roi and settings of screen_object.
+    """
+    return find_all(screen_object.name, inp_img, screen_object.threshold, _resolve_roi(screen_object),
+                    screen_object.color_match, screen_object.use_grayscale)
+
+
+def detect_screen_object(screen_object: ScreenObject, inp_img: np.ndarray = None) -> TemplateMatch:
+    """
+    Search all templates of a ScreenObject in one frame.
+    :param screen_object: ScreenObject from ui_control.ScreenObjects.
+    :param inp_img: Frame to search in. If None, a screenshot is taken and, if Screen change detection is enabled,
+    the last result is reused when no pixel in the ScreenObject's roi changed since it was computed.
+    :return: TemplateMatch of the first (or best if screen_object.best_match) template above threshold.
+    """
+    roi = _resolve_roi(screen_object)
+    seq = None
+    if inp_img is None:
+        inp_img, seq = Screen().grab_frame()
+        last = _last_detections.get(id(screen_object))
+        if (last is not None and last[1] == resolution.layout()
+                and not Screen().roi_changed_since(roi, last[0])):
+            # the window may have moved since, which changes no pixel but every monitor coordinate
+            template_match = _at_current_monitor(last[2])
+            record_detection(screen_object.key, seq, template_match)
+            return template_match
+    template_match = _detect_in_roi(screen_object, inp_img, roi, screen_object.use_pyramid)
+    if seq is not None:
+        _last_detections[id(screen_object)] = (seq, resolution.layout(), template_match)
+    return template_match
+
+
+def _at_current_monitor(template_match: TemplateMatch) -> TemplateMatch:
+    if not template_match.valid:
+        return template_match
+    return replace(template_match,
+                   center_monitor=convert_screen_to_monitor(template_match.center),
+                   region_monitor=[*convert_screen_to_monitor(template_match.region[:2]), *template_match.region[2:]])
+
+
+def record_detection(key: str, seq: int, template_match: TemplateMatch):
+    """
+    Remember the result of a ScreenObject check on the frame with frame_seq seq, for recent_detection.
+    Results of untagged images (seq 0) and of frames older than the recorded one are ignored.
+    """
+    if not seq:
+        return
+    cached = _detection_cache.get(key)
+    if cached is None or cached[0] <= seq:
+        _detection_cache[key] = (seq, time.perf_counter(), template_match)
+
+
+def recent_detection(screen_object: ScreenObject, max_age: float = None) -> TemplateMatch:
+    """
+    Result of screen_object from whichever detector checked it last, e.g. ScreenState.detect in the main loop.
+    :param max_age: Seconds after which a recorded result is not trusted anymore. Defaults to
+    Config.ui['detection_max_age'].
+    :return: The recorded TemplateMatch, or a fresh detect_screen_object if there is none recent enough.
+    """
+    max_age = Config.ui['detection_max_age'] if max_age is None else max_age
+    cached = _detection_cache.get(screen_object.key)
+    if cached is not None and time.perf_counter() - cached[1] <= max_age:
+        return cached[2]
+    return detect_screen_object(screen_object)
+
+
+async def wait_until_visible(screen_object: ScreenObject, timeout: float = 10.0) -> TemplateMatch:
+    """
+    Wait until screen_object is visible without blocking the event loop. The check runs on the screen watcher's
+    thread, once per frame for all waits together, so input tasks on the same loop keep their pacing.
+    :return: The first valid TemplateMatch, or an invalid one if screen_object was not visible within timeout.
+    """
+    # screen_watch builds on this module
+    from screen_watch import screen_watcher
+    template_match = await asyncio.wrap_future(screen_watcher().watch(screen_object, True, timeout))
+    return template_match or TemplateMatch()
 
+
+def calibrate_scale(inp_img: np.ndarray = None, anchors: list[ScreenObject] = None,
+                    scales: list[float] = None) -> tuple[float, TemplateMatch]:
+    """
+    Find the ui scale under which anchor ScreenObjects match best and make it the current scale. Meant to run once
+    after the window size changed, while nothing else is matching.
+    :param anchors: ScreenObjects that are visible on one of the screens the bot starts from. Defaults to InGame
+    and MainMenu.
+    :param scales: Candidate scales. Defaults to the scale of the frame size times CALIBRATION_STEPS.
+    :return: (scale, best anchor TemplateMatch). If no anchor scores above its threshold, the scale is unchanged
+    and the TemplateMatch is invalid.
+    """
+    inp_img = inp_img if inp_img is not None else Screen().grab()
+    anchors = anchors or [ScreenObjects.InGame, ScreenObjects.MainMenu]
+    if scales is None:
+        size_scale = resolution.scale_for_size(inp_img.shape[1], inp_img.shape[0])
+        scales = [size_scale * step for step in CALIBRATION_STEPS]
+    previous = resolution.current_scale()
+    best_scale, best = previous, TemplateMatch()
+    for scale in scales:
+        resolution.set_scale(scale)
+        for anchor in anchors:
+            template_match = search(anchor.name, inp_img, threshold=anchor.threshold, roi=_resolve_roi(anchor),
+                                    color_match=anchor.color_match, use_grayscale=anchor.use_grayscale,
+                                    best_match=True)
+            if template_match.valid and template_match.score > best.score:
+                best_scale, best = resolution.current_scale(), template_match
+    resolution.set_scale(best_scale)
+    if best.valid:
+        logger.debug(f"Calibrated ui scale {best_scale} with {best.name} ({best.score:.3f})")
+    return best_scale, best
+
+
+def _detect_in_roi(screen_object: ScreenObject, inp_img: np.ndarray, roi: list | None,
+                   use_pyramid: bool) -> TemplateMatch:
+    with tracing.span(screen_object.key, "match", seq=getattr(inp_img, "seq", 0), roi=roi) as span:
+        template_match = search(
+            screen_object.name,
+            inp_img,
+            threshold=screen_object.threshold,
+            roi=roi,
+            color_match=screen_object.color_match,
+            use_grayscale=screen_object.use_grayscale,
+            best_match=screen_object.best_match,
+            use_pyramid=use_pyramid,
+            use_features=screen_object.use_features
+        )
+        span.set(score=template_match.score, valid=template_match.valid)
+    record_detection(screen_object.key, getattr(inp_img, "seq", 0), template_match)
     return template_match
 
+
+def _largest_template(screen_object: ScreenObject) -> tuple[int, int]:
+    templates = _process_template_refs(screen_object.name, screen_object.color_match, screen_object.use_grayscale,
+                                       screen_object.use_features)
+    shapes = [(t.img_gray if t.img_gray is not None else t.img_bgr).shape[:2] for t in templates]
+    return max(w for _, w in shapes), max(h for h, _ in shapes)
+
+
+def _tracking_window(region: list[int], template_size: tuple[int, int], margin: int, roi: list[int]) -> list[int]:
+    """
+    Window of the largest template's size plus margin on every side, centred on region. Near the roi's border it is
+    shifted inside rather than clipped, so every template still fits. Windows as large as the roi are the roi.
+    """
+    cx, cy = roi_center(region)
+    w, h = template_size[0] + 2 * margin, template_size[1] + 2 * margin
+    if w >= roi[2] or h >= roi[3]:
+        return roi
+    x = min(max(roi[0], cx - w // 2), roi[0] + roi[2] - w)
+    y = min(max(roi[1], cy - h // 2), roi[1] + roi[3] - h)
+    return [x, y, w, h]
+
+
+def track_screen_object(screen_object: ScreenObject, inp_img: np.ndarray = None) -> TemplateMatch:
+    """
+    Detect a ScreenObject that moves a little between frames (e.g. TownPortal or Corpse while walking towards it).
+    Once found, a window around the last match is searched first, then a window twice as wide, then the whole roi.
+    The first of them with a match decides, so the result is valid whenever detect_screen_object's would be, but with
+    best_match it is the best template at the tracked position, not necessarily the best one anywhere in the roi.
+    Every frame on which the first window missed doubles the window the next frame starts with. After
+    TRACKING_MAX_MISSES consecutive misses, the next frame searches the whole roi right away and tracking starts
+    over from its result.
+    :param screen_object: ScreenObject from ui_control.ScreenObjects.
+    :param inp_img: Frame to search in. If None, a screenshot is taken.
+    :return: TemplateMatch like detect_screen_object.
+    """
+    inp_img = inp_img if inp_img is not None else Screen().grab()
+    roi = _resolve_roi(screen_object) or [0, 0, inp_img.shape[1], inp_img.shape[0]]
+    track = _tracks.get(id(screen_object))
+    windows = []
+    if track is not None and track.misses < TRACKING_MAX_MISSES:
+        # windows are sized by the largest template, matches of smaller ones would leave no room for it
+        template_size = _largest_template(screen_object)
+        for margin in (track.margin, 2 * track.margin):
+            window = _tracking_window(track.region, template_size, margin, roi)
+            if window is roi:
+                break
+            windows.append(window)
+    for i, window in enumerate(windows + [roi]):
+        use_pyramid = screen_object.use_pyramid if window is roi else False
+        template_match = _detect_in_roi(screen_object, inp_img, window, use_pyramid)
+        if template_match.valid:
+            break
+    else:
+        _tracks.pop(id(screen_object), None)
+        return template_match
+
+    if i == 0:
+        _tracks[id(screen_object)] = TrackState(template_match.region)
+    else:
+        # found outside the first window, start the next frame with a wider one
+        track.region = template_match.region
+        track.margin *= 2
+        track.misses += 1
+    return template_match
+
+
+def reset_tracking(screen_object: ScreenObject = None):
+    """
+    Forget the last position of screen_object, or of all tracked ScreenObjects.
+    """
+    if screen_object is None:
+        _tracks.clear()
+    else:
+        _tracks.pop(id(screen_object), None)
@@ -0,0 +1,242 @@
+import os
+import glob
+import json
+import time
+import threading
+import hashlib
+import cv2
+import numpy as np
+from loguru import logger
+
+from utils import list_files_in_folder
+
+# all templates and their derived variants are packed into one binary blob which is memory-mapped on startup. The
+# json index maps template names to (offset, shape, dtype) of each variant and remembers mtime and hash of every
+# source png, so the blob is only rebuilt when a source changes.
+TEMPLATE_STORE_PATH = "data\\templates.store"
+STORE_VERSION = 2
+STORE_ALIGNMENT = 64
+# another process may rebuild the store and remove the blob of the index just read, opening then starts over
+STORE_OPEN_ATTEMPTS = 3
+
+VARIANTS = ("img_bgra", "img_bgr", "img_gray", "alpha_mask", "orb_keypoints", "orb_descriptors")
+
+# ORB settings shared by templates and frames. The default 31 px patch finds no keypoints on most of our templates.
+ORB_PATCH_SIZE = 15
+ORB_TEMPLATE_FEATURES = 200
+# orb_keypoints columns
+KEYPOINT_FIELDS = ("x", "y", "size", "angle", "response", "octave")
+
+
+def load_template(path):
+    if os.path.isfile(path):
+        try:
+            template_img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+            return template_img
+        except Exception as e:
+            logger.error(f"Could not load template {path}: {e}")
+            raise ValueError(f"Could not load template: {path}")
+    else:
+        logger.error(f"Template does not exist: {path}")
+    return None
+
+
+def alpha_to_mask(img: np.ndarray):
+    # create a mask from template where alpha == 0
+    if img.shape[2] == 4:
+        if np.min(img[:, :, 3]) == 0:
+            _, mask = cv2.threshold(img[:, :, 3], 1, 255, cv2.THRESH_BINARY)
+            return mask
+    return None
+
+
+def orb_detector(features: int) -> cv2.ORB:
+    return cv2.ORB_create(nfeatures=features, edgeThreshold=ORB_PATCH_SIZE, patchSize=ORB_PATCH_SIZE)
+
+
+def orb_features(gray: np.ndarray, mask: np.ndarray = None,
+                 features: int = ORB_TEMPLATE_FEATURES) -> tuple[np.ndarray | None, np.ndarray | None]:
+    """
+    :return: (keypoints as float32 rows of KEYPOINT_FIELDS, uint8 descriptors), both None if none were found.
+    """
+    keypoints, descriptors = orb_detector(features).detectAndCompute(gray, mask)
+    if descriptors is None or not len(keypoints):
+        return None, None
+    rows = [(k.pt[0], k.pt[1], k.size, k.angle, k.response, k.octave) for k in keypoints]
+    return np.array(rows, dtype=np.float32), descriptors
+
+
+def template_variants(template_img: np.ndarray) -> dict[str, np.ndarray]:
+    img_gray = cv2.cvtColor(template_img, cv2.COLOR_BGRA2GRAY)
+    alpha_mask = alpha_to_mask(template_img)
+    orb_keypoints, orb_descriptors = orb_features(img_gray, alpha_mask)
+    variants = {
+        "img_bgra": template_img,
+        "img_bgr": cv2.cvtColor(template_img, cv2.COLOR_BGRA2BGR),
+        "img_gray": img_gray,
+        "alpha_mask": alpha_mask,
+        "orb_keypoints": orb_keypoints,
+        "orb_descriptors": orb_descriptors,
+    }
+    return {k: v for k, v in variants.items() if v is not None}
+
+
+def template_sources(folders: list[str]) -> dict[str, str]:
+    """
+    :return: Template name -> png path for all templates in folders.
+    """
+    sources = {}
+    for folder in folders:
+        for file_path in list_files_in_folder(folder):
+            file_name = os.path.basename(file_path)
+            if file_name.lower().endswith('.png'):
+                sources[file_name[:-4].upper()] = file_path
+    return sources
+
+
+def _file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _index_path(store_path: str) -> str:
+    return store_path + ".json"
+
+
+def _read_index(store_path: str) -> dict | None:
+    try:
+        with open(_index_path(store_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_index(index: dict, store_path: str):
+    # written next to the index and moved over it, so readers never see a partial file
+    index_path = _index_path(store_path)
+    tmp_path = f"{index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+
+
+def _blob_path(index: dict, store_path: str) -> str:
+    return os.path.join(os.path.dirname(store_path), index["blob"])
+
+
+class TemplateStore:
+    """
+    Read-only view on a built template store. Variants are returned as views into the memory-mapped blob, so pages
+    are only read from disk when a template is actually used and are shared between processes.
+    """
+
+    def __init__(self, index: dict, blob_path: str):
+        self.index = index
+        self.blob = np.memmap(blob_path, dtype=np.uint8, mode="r") if os.path.getsize(blob_path) else None
+
+    def keys(self):
+        return self.index["templates"].keys()
+
+    def __contains__(self, key: str):
+        return key in self.index["templates"]
+
+    def variant(self, key: str, variant: str) -> np.ndarray | None:
+        entry = self.index["templates"][key]["variants"].get(variant)
+        if entry is None:
+            return None
+        dtype = np.dtype(entry["dtype"])
+        count = int(np.prod(entry["shape"]))
+        return np.frombuffer(self.blob, dtype=dtype, count=count, offset=entry["offset"]).reshape(entry["shape"])
+
+    def variants(self, key: str) -> dict[str, np.ndarray]:
+        return {v: self.variant(key, v) for v in VARIANTS}
+
+
+def build_store(folders: list[str], store_path: str = TEMPLATE_STORE_PATH) -> dict:
+    """
+    Decode all templates in folders and pack them with their derived variants into a new blob.
+    :return: The index of the new store.
+    """
+    start = time.perf_counter()
+    sources = template_sources(folders)
+    index = {"version": STORE_VERSION, "sources": {}, "templates": {}}
+    build_ns = time.time_ns()
+    blob_path = f"{store_path}.{build_ns}"
+    offset = 0
+    with open(blob_path, "wb") as f:
+        for key, path in sources.items():
+            template_img = load_template(path)
+            if template_img is None:
+                continue
+            index["sources"][path] = {"mtime": os.path.getmtime(path), "sha1": _file_hash(path)}
+            entry = {"source": path, "variants": {}}
+            for name, img in template_variants(template_img).items():
+                padding = -offset % STORE_ALIGNMENT
+                f.write(b"\0" * padding)
+                offset += padding
+                img = np.ascontiguousarray(img)
+                f.write(img.tobytes())
+                entry["variants"][name] = {"offset": offset, "shape": list(img.shape), "dtype": img.dtype.str}
+                offset += img.nbytes
+            index["templates"][key] = entry
+    index["blob"] = os.path.basename(blob_path)
+
+    _write_index(index, store_path)
+
+    # only blobs of older builds are removed, a newer one belongs to a concurrent build whose index is about to
+    # replace this one. Blobs still mapped by other bot processes are removed next time.
+    for old_blob in glob.glob(glob.escape(store_path) + ".*"):
+        suffix = old_blob[len(store_path) + 1:]
+        if suffix.isdigit() and int(suffix) < build_ns:
+            try:
+                os.remove(old_blob)
+            except OSError:
+                pass
+    logger.debug(f"Built template store with {len(index['templates'])} templates in {time.perf_counter() - start:.2f}s")
+    return index
+
+
+def _is_stale(index: dict, folders: list[str], store_path: str) -> bool:
+    if index.get("version") != STORE_VERSION:
+        return True
+    if not os.path.isfile(_blob_path(index, store_path)):
+        return True
+    sources = set(template_sources(folders).values())
+    if sources != set(index["sources"].keys()):
+        return True
+    touched = False
+    for path, stored in index["sources"].items():
+        mtime = os.path.getmtime(path)
+        if mtime == stored["mtime"]:
+            continue
+        # mtime changes on checkout or copy, only a different hash requires a rebuild
+        if _file_hash(path) != stored["sha1"]:
+            return True
+        stored["mtime"] = mtime
+        touched = True
+    if touched:
+        _write_index(index, store_path)
+    return False
+
+
+def open_store(folders: list[str], store_path: str = TEMPLATE_STORE_PATH) -> TemplateStore:
+    """
+    Open the template store for folders, rebuilding it if it is missing or any source png changed.
+    """
+    index = _read_index(store_path)
+    for attempt in range(STORE_OPEN_ATTEMPTS):
+        if index is None or _is_stale(index, folders, store_path):
+            index = build_store(folders, store_path)
+        try:
+            return TemplateStore(index, _blob_path(index, store_path))
+        except FileNotFoundError:
+            if attempt == STORE_OPEN_ATTEMPTS - 1:
+                raise
+            # a concurrent build removed the blob after the index was read, its own index is newer
+            logger.debug(f"Template store blob {index['blob']} was removed, opening the store again")
+            index = _read_index(store_path)
+
+
+if __name__ == '__main__':
+    from template_finder import TEMPLATE_PATHS
+    build_store(TEMPLATE_PATHS)
@@ -0,0 +1,101 @@
+"""
+Lightweight per-frame tracing. While disabled, span() returns a shared no-op context manager, so instrumented code
+only pays for one function call. Enabled spans are appended to a bounded deque (append is atomic, no lock is taken)
+and can be exported as Chrome trace-event json (chrome://tracing, https://ui.perfetto.dev).
+"""
+import os
+import json
+import time
+import threading
+from collections import deque
+
+ENABLED = False
+DEFAULT_CAPACITY = 65536
+
+# (name, category, start ns, duration ns, thread id, args)
+_events = deque(maxlen=DEFAULT_CAPACITY)
+
+
+class _Span:
+    __slots__ = ("name", "cat", "args", "start")
+
+    def __init__(self, name: str, cat: str, args: dict):
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        _events.append((self.name, self.cat, self.start, time.perf_counter_ns() - self.start, threading.get_ident(),
+                        self.args))
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name: str, cat: str, **args):
+    """
+    Time a block: with span("InGame", "match", seq=seq) as s: ...; s.set(score=score)
+    :param name: Event name, e.g. the ScreenObject key.
+    :param cat: Event category: "capture", "convert", "match" or "input".
+    :param args: Extra data shown with the event. By convention seq is the frame_seq the work belongs to.
+    """
+    if not ENABLED:
+        return _NO_SPAN
+    return _Span(name, cat, args)
+
+
+def enable(capacity: int = DEFAULT_CAPACITY):
+    global ENABLED, _events
+    if capacity != _events.maxlen:
+        _events = deque(_events, maxlen=capacity)
+    ENABLED = True
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+def clear():
+    _events.clear()
+
+
+def events() -> list[tuple]:
+    return list(_events)
+
+
+def export_chrome_trace(path: str):
+    pid = os.getpid()
+    trace = [{
+        "name": name,
+        "cat": cat,
+        "ph": "X",
+        "ts": start / 1000,
+        "dur": duration / 1000,
+        "pid": pid,
+        "tid": tid,
+        "args": args,
+    } for name, cat, start, duration, tid, args in list(_events)]
+    with open(path, "w") as f:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
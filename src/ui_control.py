@@ -17,6 +17,13 @@ class ScreenObject:
     best_match: bool = False
     use_grayscale: bool = False
     color_match: list[np.array] = None
+    use_pyramid: bool = False
+    # locate the templates by ORB keypoints, see template_finder.search
+    use_features: bool = False
+    # keys of the ScreenObjects this one can only appear together with, None if it can appear anywhere
+    parents: list[str] = None
+    # attribute name in ScreenObjects, e.g. "InGame". Set below for all ScreenObjects.
+    key: str = None
 
     def __call__(self, cls):
         cls._screen_object = self
@@ -35,26 +42,30 @@ class ScreenObjects:
         name=["LABEL_WAYPOINT"],
         roi_name="left_panel_header",
         threshold=0.8,
-        use_grayscale=True
+        use_grayscale=True,
+        parents=["LeftPanel"]
     )
     WaypointTabs = ScreenObject(
         name=["WP_A1_ACTIVE", "WP_A2_ACTIVE", "WP_A3_ACTIVE", "WP_A4_ACTIVE", "WP_A5_ACTIVE"],
         roi_name="wp_act_roi_name",
         threshold=0.8,
         best_match=True,
-        use_grayscale=True
+        use_grayscale=True,
+        parents=["LeftPanel"]
     )
     MercIcon = ScreenObject(
         name=["MERC_A2", "MERC_A1", "MERC_A5", "MERC_A3"],
         roi_name="merc_icon",
         threshold=0.9,
-        use_grayscale=True
+        use_grayscale=True,
+        parents=["InGame"]
     )
     PlayBtn = ScreenObject(
         name=["PLAY_BTN", "PLAY_BTN_GRAY"],
         roi_name="play_btn",
         best_match=True,
-        use_grayscale=True
+        use_grayscale=True,
+        parents=["MainMenu"]
     )
     MainMenu = ScreenObject(
         name=["MAIN_MENU_TOP_LEFT", "MAIN_MENU_TOP_LEFT_DARK"],
@@ -72,26 +83,31 @@ class ScreenObjects:
         name=["HORADRIC_CUBE"],
         roi_name="left_inventory",
         threshold=0.8,
-        use_grayscale=True
+        use_grayscale=True,
+        parents=["LeftPanel"]
     )
     CubeOpened = ScreenObject(
         name=["CUBE_TRANSMUTE_BTN"],
         roi_name="cube_btn_roi_name",
         threshold=0.8,
-        use_grayscale=True
+        use_grayscale=True,
+        parents=["LeftPanel"]
     )
     OnlineStatus = ScreenObject(
         name=["CHARACTER_STATE_ONLINE", "CHARACTER_STATE_OFFLINE"],
         roi_name="character_online_status",
         best_match=True,
+        parents=["MainMenu"]
     )
     SelectedCharacter = ScreenObject(
         name=["CHARACTER_ACTIVE"],
         roi_name="character_select",
         threshold=0.8,
+        parents=["MainMenu"]
     )
     ServerError = ScreenObject(
-        name=["SERVER_ISSUES"]
+        name=["SERVER_ISSUES"],
+        use_pyramid=True
     )
     SaveAndExit = ScreenObject(
         name=["SAVE_AND_EXIT_NO_HIGHLIGHT", "SAVE_AND_EXIT_HIGHLIGHT"],
@@ -101,56 +117,67 @@ class ScreenObjects:
     )
     NeedRepair = ScreenObject(
         name=["REPAIR_NEEDED"],
-        roi_name="repair_needed"
+        roi_name="repair_needed",
+        parents=["InGame"]
     )
     ItemPickupText = ScreenObject(
         name=["ITEM_PICKUP_ENABLED", "ITEM_PICKUP_DISABLED"],
         roi_name="chat_line_1",
-        best_match=True
+        best_match=True,
+        parents=["InGame"]
     )
     ShrineArea = ScreenObject(
         name=["SHRINE", "HIDDEN_STASH", "SKULL_PILE"],
         roi_name="shrine_check",
-        threshold=0.8
+        threshold=0.8,
+        parents=["InGame"]
     )
     TownPortal = ScreenObject(
         name=["BLUE_PORTAL"],
         threshold=0.8,
-        roi_name="tp_search"
+        roi_name="tp_search",
+        parents=["InGame"]
     )
     TownPortalReduced = ScreenObject(
         name=["BLUE_PORTAL"],
         threshold=0.8,
-        roi_name="reduce_to_center"
+        roi_name="reduce_to_center",
+        parents=["InGame"]
     )
     GoldBtnInventory = ScreenObject(
         name=["INVENTORY_GOLD_BTN"],
         roi_name="gold_btn",
-        use_grayscale=True
+        use_grayscale=True,
+        parents=["RightPanel"]
     )
     GoldBtnStash = ScreenObject(
         name=["INVENTORY_GOLD_BTN"],
-        roi_name="gold_btn_stash"
+        roi_name="gold_btn_stash",
+        parents=["LeftPanel"]
     )
     GoldBtnVendor = ScreenObject(
         name=["VENDOR_GOLD"],
-        roi_name="gold_btn_stash"
+        roi_name="gold_btn_stash",
+        parents=["LeftPanel"]
     )
     GoldNone = ScreenObject(
         name=["INVENTORY_NO_GOLD"],
         roi_name="inventory_gold",
-        threshold=0.83
+        threshold=0.83,
+        parents=["RightPanel"]
     )
     TownPortalSkill = ScreenObject(
         name=["TP_ACTIVE", "TP_INACTIVE"],
         roi_name="skill_right",
         best_match=True,
-        threshold=0.79
+        threshold=0.79,
+        parents=["InGame"]
     )
     RepairBtn = ScreenObject(
         name=["REPAIR_BTN"],
         roi_name="repair_btn",
-        use_grayscale=True
+        use_grayscale=True,
+        parents=["LeftPanel"]
     )
     YouHaveDied = ScreenObject(
         name=["YOU_HAVE_DIED"],
@@ -162,92 +189,117 @@ class ScreenObjects:
     Overburdened = ScreenObject(
         name=["INVENTORY_FULL_MSG_0", "INVENTORY_FULL_MSG_1"],
         roi_name="chat_line_1",
-        threshold=0.9
+        threshold=0.9,
+        parents=["InGame"]
     )
     Corpse = ScreenObject(
         name=["CORPSE", "CORPSE_2", "CORPSE_BARB", "CORPSE_DRU", "CORPSE_NEC", "CORPSE_PAL", "CORPSE_SIN",
               "CORPSE_SORC",
               "CORPSE_ZON"],
         roi_name="corpse",
-        threshold=0.8
+        threshold=0.8,
+        parents=["InGame"]
     )
     BeltExpandable = ScreenObject(
         name=["BELT_EXPANDABLE"],
         roi_name="gamebar_belt_expandable",
-        threshold=0.8
+        threshold=0.8,
+        parents=["InGame"]
     )
     NPCMenu = ScreenObject(
         name=["TALK", "CANCEL"],
         threshold=0.8,
-        use_grayscale=True
+        use_grayscale=True,
+        use_pyramid=True,
+        parents=["InGame"]
     )
     ChatIcon = ScreenObject(
         name=["CHAT_ICON"],
         roi_name="chat_icon",
         threshold=0.8,
-        use_grayscale=True
+        use_grayscale=True,
+        parents=["InGame"]
     )
     LeftPanel = ScreenObject(
         name=["CLOSE_PANEL"],
         roi_name="left_panel_header",
         threshold=0.8,
-        use_grayscale=True
+        use_grayscale=True,
+        parents=["InGame"]
     )
     RightPanel = ScreenObject(
         name=["CLOSE_PANEL", "CLOSE_PANEL_2"],
         roi_name="right_panel_header",
         threshold=0.8,
-        use_grayscale=True
+        use_grayscale=True,
+        parents=["InGame"]
     )
     NPCDialogue = ScreenObject(
         name=["NPC_DIALOGUE"],
         roi_name="npc_dialogue",
         threshold=0.8,
-        use_grayscale=True
+        use_grayscale=True,
+        parents=["InGame"]
     )
     SkillsExpanded = ScreenObject(
         name=["BIND_SKILL"],
         roi_name="bind_skill",
         threshold=0.8,
-        use_grayscale=True
+        use_grayscale=True,
+        parents=["InGame"]
     )
     Unidentified = ScreenObject(
         name=["UNIDENTIFIED"],
         threshold=0.8,
-        color_match=Config().colors["red"]
+        color_match=Config().colors["red"],
+        use_pyramid=True,
+        parents=["LeftPanel", "RightPanel"]
     )
     Key = ScreenObject(
         name=["INV_KEY"],
-        threshold=0.8
+        threshold=0.8,
+        use_pyramid=True,
+        parents=["RightPanel"]
     )
     EmptyStashSlot = ScreenObject(
         name=["STASH_EMPTY_SLOT"],
         roi_name="left_inventory",
         threshold=0.8,
+        parents=["LeftPanel"]
     )
     NotEnoughGold = ScreenObject(
         name=["NOT_ENOUGH_GOLD"],
         threshold=0.9,
         color_match=Config().colors["red"],
-        use_grayscale=True
+        use_grayscale=True,
+        parents=["InGame"]
     )
     QuestSkillBtn = ScreenObject(
         name=["QUEST_SKILL_BTN"],
         threshold=0.9,
         use_grayscale=True,
-        roi_name="quest_skill_btn"
+        roi_name="quest_skill_btn",
+        parents=["LeftPanel"]
     )
     TabIndicator = ScreenObject(
         name=["TAB_INDICATOR"],
         roi_name="tab_indicator",
+        parents=["LeftPanel"]
     )
     DepositBtn = ScreenObject(
         name=["DEPOSIT_BTN", "DEPOSIT_BTN_BRIGHT"],
         threshold=0.8,
         roi_name="deposit_btn",
+        parents=["LeftPanel"]
     )
     InventoryBackground = ScreenObject(
         name=["INVENTORY_BG_PATTERN"],
         roi_name="inventory_bg_pattern",
         threshold=0.8,
+        parents=["RightPanel"]
     )
+
+
+for _key, _screen_object in vars(ScreenObjects).items():
+    if isinstance(_screen_object, ScreenObject):
+        _screen_object.key = _key
@@ -13,6 +13,11 @@ def roi_center(roi: list[float] = None):
     return round(x + w / 2), round(y + h / 2)
 
 
+def is_in_roi(roi: list[float], pos: tuple[float, float]):
+    x, y, w, h = roi
+    return x <= pos[0] < x + w and y <= pos[1] < y + h
+
+
 def mask_by_roi(img, roi, op: str = "regular"):
     x, y, w, h = roi
     if op == "regular":
@@ -0,0 +1,212 @@
+import threading
+from loguru import logger
+
+from config import Config
+
+
+class WindowApi:
+    """
+    The few window system calls window discovery needs, so tracking can run against a fake window list.
+    """
+
+    def list_windows(self) -> list[int]:
+        raise NotImplementedError
+
+    def window_pid(self, hwnd: int) -> int:
+        raise NotImplementedError
+
+    def process_name(self, pid: int) -> str:
+        raise NotImplementedError
+
+    def client_rect(self, hwnd: int) -> tuple[int, int, int, int]:
+        """
+        :return: (left, top, width, height) of the window's client area in screen coordinates.
+        :raises Exception: If the window does not exist anymore.
+        """
+        raise NotImplementedError
+
+
+class Win32WindowApi(WindowApi):
+    def __init__(self):
+        import psutil
+        from win32gui import EnumWindows, GetClientRect, ClientToScreen
+        from win32process import GetWindowThreadProcessId
+        self._psutil = psutil
+        self._enum_windows = EnumWindows
+        self._get_client_rect = GetClientRect
+        self._client_to_screen = ClientToScreen
+        self._get_window_thread_process_id = GetWindowThreadProcessId
+
+    def list_windows(self) -> list[int]:
+        window_list = []
+        self._enum_windows(lambda w, l: l.append(w), window_list)
+        return window_list
+
+    def window_pid(self, hwnd: int) -> int:
+        return self._get_window_thread_process_id(hwnd)[1]
+
+    def process_name(self, pid: int) -> str:
+        try:
+            return self._psutil.Process(pid).name()
+        except (self._psutil.NoSuchProcess, self._psutil.AccessDenied):
+            return ""
+
+    def client_rect(self, hwnd: int) -> tuple[int, int, int, int]:
+        left, top, right, bottom = self._get_client_rect(hwnd)
+        return (*self._client_to_screen(hwnd, (left, top)), right - left, bottom - top)
+
+
+class FakeWindowApi(WindowApi):
+    """
+    Window list for tests and for running on Linux: hwnd -> (pid, process name, client rect).
+    Calls are counted in calls, so tests can check what discovery costs.
+    """
+
+    def __init__(self, windows: dict[int, tuple[int, str, tuple[int, int, int, int]]] = None):
+        self.windows = dict(windows or {})
+        self.calls = {"list_windows": 0, "window_pid": 0, "process_name": 0, "client_rect": 0}
+
+    def add_window(self, hwnd: int, pid: int, name: str,
+                   rect: tuple[int, int, int, int] = (0, 0, Config.ui['window_width'], Config.ui['window_height'])):
+        self.windows[hwnd] = (pid, name, rect)
+
+    def remove_window(self, hwnd: int):
+        self.windows.pop(hwnd, None)
+
+    def move_window(self, hwnd: int, origin: tuple[int, int], size: tuple[int, int] = None):
+        pid, name, rect = self.windows[hwnd]
+        self.windows[hwnd] = (pid, name, (*origin, *(size or rect[2:])))
+
+    def list_windows(self) -> list[int]:
+        self.calls["list_windows"] += 1
+        return list(self.windows)
+
+    def window_pid(self, hwnd: int) -> int:
+        self.calls["window_pid"] += 1
+        return self.windows[hwnd][0] if hwnd in self.windows else 0
+
+    def process_name(self, pid: int) -> str:
+        self.calls["process_name"] += 1
+        return next((name for p, name, _ in self.windows.values() if p == pid), "")
+
+    def client_rect(self, hwnd: int) -> tuple[int, int, int, int]:
+        self.calls["client_rect"] += 1
+        if hwnd not in self.windows:
+            raise OSError(f"Invalid window handle {hwnd}")
+        return self.windows[hwnd][2]
+
+
+def default_window_api() -> WindowApi | None:
+    try:
+        return Win32WindowApi()
+    except ImportError:
+        return None
+
+
+class WindowTracker:
+    """
+    Finds the game window and follows its position.
+    Process names are cached per pid, so a discovery pass only asks the OS about processes it has not seen yet.
+    While no window is found, discovery backs off from discovery_min_interval to discovery_max_interval; wake()
+    starts over immediately. The found window is published as one (hwnd, (left, top, width, height)) tuple, so
+    readers never need a lock.
+    """
+
+    def __init__(self, api: WindowApi = None, process_name: str = Config.game['window_process'], on_change=None):
+        self.api = api if api is not None else default_window_api()
+        self.process_name = process_name
+        # callback(hwnd, (left, top, width, height)) whenever window, position or size change. hwnd is None once the
+        # window is lost.
+        self.on_change = on_change
+        self.pid_names = {}
+        self.window: tuple[int, tuple[int, int, int, int]] | None = None
+        self.interval = Config.game['discovery_min_interval']
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self.thread = None
+
+    def find_windows(self, first_only: bool = False) -> list[int]:
+        """
+        :return: Handles of all windows belonging to a process whose name contains process_name.
+        """
+        if self.api is None:
+            # no window system to ask, e.g. on Linux without a fake window list
+            return []
+        found = []
+        seen_pids = set()
+        for hwnd in self.api.list_windows():
+            pid = self.api.window_pid(hwnd)
+            if pid <= 0:
+                continue
+            seen_pids.add(pid)
+            if pid not in self.pid_names:
+                self.pid_names[pid] = self.api.process_name(pid)
+            if self.process_name in self.pid_names[pid]:
+                found.append(hwnd)
+                if first_only:
+                    break
+        if not (first_only and found):
+            # pids are reused, forget processes that do not own a window anymore
+            self.pid_names = {pid: name for pid, name in self.pid_names.items() if pid in seen_pids}
+        return found
+
+    def _publish(self, window: tuple[int, tuple[int, int, int, int]] | None):
+        if window == self.window:
+            return
+        self.window = window
+        if self.on_change is not None:
+            self.on_change(*(window or (None, None)))
+
+    def poll(self) -> float:
+        """
+        Look for the window if it is not known yet, otherwise update its position.
+        :return: Seconds until the next poll.
+        """
+        window = self.window
+        if window is not None:
+            try:
+                self._publish((window[0], self.api.client_rect(window[0])))
+                return Config.game['window_track_interval']
+            except Exception:
+                logger.debug(f"Game window {window[0]} is gone")
+                self._publish(None)
+                self.interval = Config.game['discovery_min_interval']
+        windows = self.find_windows(first_only=True)
+        if windows:
+            try:
+                self._publish((windows[0], self.api.client_rect(windows[0])))
+                self.interval = Config.game['discovery_min_interval']
+                return Config.game['window_track_interval']
+            except Exception:
+                pass
+        logger.debug("Game not found.")
+        interval = self.interval
+        self.interval = min(self.interval * 2, Config.game['discovery_max_interval'])
+        return interval
+
+    def wake(self):
+        """
+        Poll right away, e.g. after a capture failed because the window moved or closed.
+        """
+        self.interval = Config.game['discovery_min_interval']
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            delay = self.poll()
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self._stop.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,36 @@
+import os
+import sys
+import pytest
+
+# the bot's modules import each other by module name from src
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "timing: tight wall clock bounds, only run with TIMING_TESTS=1")
+
+
+def pytest_collection_modifyitems(config, items):
+    # scheduler jitter on loaded machines (e.g. ci runners) exceeds these bounds now and then
+    if os.environ.get("TIMING_TESTS") == "1":
+        return
+    skip = pytest.mark.skip(reason="set TIMING_TESTS=1 to check tight timing bounds")
+    for item in items:
+        if "timing" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture(autouse=True)
+def reset_resolution():
+    # the ui scale and client size are process wide, keep them from leaking between tests
+    import resolution
+    yield
+    resolution._client_size = None
+    resolution.set_scale(1.0)
+
+
+@pytest.fixture
+def window_at_origin(monkeypatch):
+    # matches convert their positions to monitor coordinates, which needs a known window position
+    from screen import Screen
+    monkeypatch.setattr(Screen, "monitor", {**Screen.monitor, "left": 0, "top": 0})
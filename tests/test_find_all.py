@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from template_finder import find_all, _local_peaks, _non_max_suppression
+
+FRAME_SHAPE = (200, 300, 3)
+
+
+def _stamp(seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 255, (20, 30, 3), dtype=np.uint8)
+
+
+STAMP, OTHER = _stamp(1), _stamp(2)
+
+
+def _frame(*placed: tuple[np.ndarray, int, int]) -> np.ndarray:
+    frame = np.zeros(FRAME_SHAPE, dtype=np.uint8)
+    for stamp, x, y in placed:
+        frame[y:y + stamp.shape[0], x:x + stamp.shape[1]] = stamp
+    return frame
+
+
+@pytest.fixture(autouse=True)
+def _window(window_at_origin):
+    pass
+
+
+def test_every_repeated_stamp_is_found_once():
+    positions = [(10, 10), (60, 10), (110, 10), (10, 80), (200, 150)]
+    matches = find_all(STAMP, _frame(*[(STAMP, x, y) for x, y in positions]), threshold=0.9)
+    assert sorted(tuple(m.region[:2]) for m in matches) == sorted(positions)
+    assert all(m.region[2:] == [30, 20] for m in matches)
+    assert all(m.score > 0.99 for m in matches)
+
+
+def test_partly_covered_stamps_are_both_found():
+    # the second stamp covers a third of the first, their boxes overlap by less than FIND_ALL_MAX_OVERLAP
+    matches = find_all(STAMP, _frame((STAMP, 50, 50), (STAMP, 70, 50)), threshold=0.6)
+    assert [m.region[:2] for m in matches] == [[70, 50], [50, 50]]
+    assert matches[0].score > matches[1].score
+
+
+def test_overlapping_peaks_keep_only_the_best():
+    matches = find_all(STAMP, _frame((STAMP, 50, 50), (STAMP, 56, 52)), threshold=0.3, max_overlap=0.3)
+    assert [m.region[:2] for m in matches] == [[56, 52]]
+
+
+def test_equal_neighbours_of_a_plateau_are_all_peaks():
+    res = np.zeros((40, 60), dtype=np.float32)
+    res[10, 20:22] = 0.9
+    res[30, 50] = 0.8
+    scores, xs, ys = _local_peaks(res, 0.5, (30, 20))
+    assert sorted(zip(xs.tolist(), ys.tolist())) == [(20, 10), (21, 10), (50, 30)]
+    # the plateau's peaks are one match after suppression
+    boxes = np.stack([xs, ys, np.full_like(xs, 30), np.full_like(xs, 20)], axis=1)
+    keep = _non_max_suppression(boxes, scores, 0.3)
+    assert len(keep) == 2
+    assert sorted(xs[keep].tolist()) == [20, 50]
+
+
+def test_non_max_suppression_keeps_best_first():
+    boxes = np.array([[0, 0, 10, 10], [1, 1, 10, 10], [50, 50, 10, 10], [5, 0, 10, 10]])
+    scores = np.array([0.7, 0.9, 0.8, 0.75])
+    # [5, 0] overlaps the best box [1, 1] by less than 0.5, but [0, 0] does not
+    assert _non_max_suppression(boxes, scores, 0.5).tolist() == [1, 2, 3]
+
+
+def test_matches_of_different_templates_suppress_each_other():
+    noisy = np.clip(STAMP.astype(int) + np.random.default_rng(3).integers(-40, 40, STAMP.shape), 0, 255)
+    noisy = noisy.astype(np.uint8)
+    matches = find_all([noisy, OTHER, STAMP], _frame((STAMP, 40, 40), (OTHER, 150, 100)), threshold=0.8)
+    assert sorted(m.region[:2] for m in matches) == [[40, 40], [150, 100]]
+    # noisy matches the stamp as well, but the stamp's own template matches it better and suppresses it
+    noisy_score = find_all(noisy, _frame((STAMP, 40, 40)), threshold=0.8)[0].score
+    assert noisy_score < 0.99
+    assert all(m.score > 0.99 for m in matches)
@@ -0,0 +1,48 @@
+import numpy as np
+
+from frame_buffer import Frame, FrameRing
+
+SHAPE = (4, 6, 3)
+
+
+def test_buffers_are_reused_in_turn():
+    ring = FrameRing(3)
+    buffers = [ring.next_buffer(SHAPE) for _ in range(3)]
+    assert len({id(b) for b in buffers}) == 3
+    assert ring.next_buffer(SHAPE) is buffers[0]
+
+
+def test_new_shape_reallocates():
+    ring = FrameRing(2)
+    buffer = ring.next_buffer(SHAPE)
+    assert ring.next_buffer((8, 6, 3)).shape == (8, 6, 3)
+    assert all(b is not buffer for b in ring.buffers)
+
+
+def test_published_frame_is_tagged_and_read_only():
+    ring = FrameRing(2)
+    frame = ring.publish(ring.next_buffer(SHAPE), 7)
+    assert isinstance(frame, Frame) and frame.seq == 7
+    assert not frame.flags.writeable
+
+
+def test_derived_arrays_are_untagged():
+    ring = FrameRing(2)
+    buffer = ring.next_buffer(SHAPE)
+    buffer[:] = 1
+    frame = ring.publish(buffer, 7)
+    # a crop, copy or computed image must never hit the caches of the whole frame
+    assert frame[1:3, 2:5].seq == 0
+    assert frame.copy().seq == 0
+    assert (frame + 1).seq == 0
+    assert np.asarray(frame).base is not None
+
+
+
+def test_is_valid_until_the_buffer_is_written_again():
+    ring = FrameRing(4)
+    frames = [ring.publish(ring.next_buffer(SHAPE), seq) for seq in range(1, 5)]
+    # while frame 4 is the latest, the next capture is already writing into the buffer of frame 1
+    assert not ring.is_valid(frames[0], 4)
+    assert all(ring.is_valid(f, 4) for f in frames[1:])
+    assert not ring.is_valid(frames[1], 5)
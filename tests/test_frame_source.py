@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+import frame_source
+from frame_source import FrameSource, RecordingFrameSource, ReplayFrameSource, RECORDING_MAGIC
+
+MONITOR = {"left": 0, "top": 0, "width": 8, "height": 6}
+
+
+class CountingSource(FrameSource):
+    needs_window = False
+
+    def __init__(self):
+        self.count = 0
+
+    def grab(self, monitor: dict) -> np.ndarray:
+        self.count += 1
+        return np.full(self.frame_shape(monitor), self.count * 10, dtype=np.uint8)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(frame_source.time, "perf_counter", clock)
+    return clock
+
+
+def _record(path, clock: Clock, frames: int, period: float = 0.04):
+    recording = RecordingFrameSource(CountingSource(), str(path))
+    out = np.empty(recording.frame_shape(MONITOR), dtype=np.uint8)
+    for _ in range(frames):
+        recording.grab_into(MONITOR, out)
+        clock.now += period
+    recording.close()
+
+
+def _value(image: np.ndarray) -> int:
+    return int(image[0, 0, 0])
+
+
+def test_replay_returns_the_recorded_frames_in_order(tmp_path, clock):
+    _record(tmp_path / "rec", clock, 3)
+    replay = ReplayFrameSource(str(tmp_path / "rec"), realtime=False)
+    assert len(replay) == 3
+    assert replay.frame_shape(MONITOR) == (6, 8, 3)
+    assert [_value(replay.grab(MONITOR)) for _ in range(5)] == [10, 20, 30, 30, 30]
+    assert replay.exhausted
+
+
+def test_replay_loops(tmp_path, clock):
+    _record(tmp_path / "rec", clock, 3)
+    replay = ReplayFrameSource(str(tmp_path / "rec"), realtime=False, loop=True)
+    assert [_value(replay.grab(MONITOR)) for _ in range(5)] == [10, 20, 30, 10, 20]
+    assert not replay.exhausted
+
+
+def test_realtime_replay_follows_the_recorded_timing(tmp_path, clock):
+    _record(tmp_path / "rec", clock, 4, period=0.1)
+    replay = ReplayFrameSource(str(tmp_path / "rec"))
+    values = []
+    for elapsed in (0.0, 0.05, 0.1, 0.25, 1.0):
+        clock.now = 200.0 + elapsed
+        values.append(_value(replay.grab(MONITOR)))
+    assert values == [10, 10, 20, 30, 40]
+
+
+def test_truncated_recording_keeps_the_complete_frames(tmp_path, clock):
+    path = tmp_path / "rec"
+    _record(path, clock, 3)
+    data = path.read_bytes()
+    path.write_bytes(data[:-10])
+    replay = ReplayFrameSource(str(path), realtime=False)
+    assert len(replay) == 2
+
+
+def test_not_a_recording(tmp_path):
+    (tmp_path / "empty").write_bytes(RECORDING_MAGIC)
+    (tmp_path / "other").write_bytes(b"not a recording")
+    with pytest.raises(ValueError):
+        ReplayFrameSource(str(tmp_path / "empty"))
+    with pytest.raises(ValueError):
+        ReplayFrameSource(str(tmp_path / "other"))
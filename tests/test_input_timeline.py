@@ -0,0 +1,107 @@
+import time
+import asyncio
+import pytest
+
+from input_timeline import Timeline, TimelineScheduler, NullInputBackend, compile_move, compile_click, \
+    compile_write, sleep_until
+
+# bounds of the timing tests, which only run with TIMING_TESTS=1 (see conftest.py)
+MAX_EVENT_ERROR = 0.015
+MAX_ASYNC_EVENT_ERROR = 0.03
+# perf_counter readings of the scheduler and the backend differ by the time between the two calls
+CLOCK_SLACK = 0.001
+
+
+def test_compile_move_reaches_the_last_point_in_duration():
+    timeline = compile_move([(0, 0), (100, 0), (100, 50)], 0.2, step_rate=100)
+    times = [e.t for e in timeline.events]
+    assert times == sorted(times)
+    assert abs(timeline.duration - 0.2) < 1e-9
+    assert timeline.events[-1].args == (100, 50)
+    assert all(e.action == "move" for e in timeline.events)
+
+
+def test_compile_move_drops_steps_that_do_not_move_the_cursor():
+    timeline = compile_move([(0, 0), (2, 0)], 0.1, step_rate=1000)
+    positions = [e.args for e in timeline.events]
+    assert len(positions) == len(set(positions))
+    assert positions[-1] == (2, 0)
+
+
+def test_compile_click_and_write():
+    click = compile_click("left", hold=0.05)
+    assert [(e.t, e.action, e.args) for e in click.events] == [(0.0, "press", ("left",)), (0.05, "release", ("left",))]
+    write = compile_write("abc", 0.1)
+    assert [(e.t, e.args) for e in write.events] == [(0.0, ("a",)), (0.1, ("b",)), (0.2, ("c",))]
+
+
+def test_then_and_extend_are_relative_to_the_last_event():
+    timeline = Timeline().add(0.0, "press", "left").then(0.1, "release", "left")
+    timeline.extend(compile_click("right", 0.05), delay=0.2)
+    assert [round(e.t, 9) for e in timeline.events] == [0.0, 0.1, 0.3, 0.35]
+
+
+def test_sleep_until_does_not_return_early():
+    for delay in (0.0005, 0.003, 0.02):
+        target = time.perf_counter() + delay
+        sleep_until(target)
+        assert time.perf_counter() >= target
+
+
+def test_run_sends_every_event_in_order():
+    backend = NullInputBackend()
+    timeline = compile_move([(0, 0), (40, 40)], 0.05, step_rate=200).extend(compile_click("left", 0.02))
+    TimelineScheduler(backend).run(timeline)
+    assert [(action, args) for _, action, args in backend.calls] == [(e.action, e.args) for e in timeline.events]
+
+
+def test_run_never_sends_events_early():
+    backend = NullInputBackend()
+    timeline = compile_move([(0, 0), (300, 0)], 0.2, step_rate=250)
+    start = time.perf_counter()
+    report = TimelineScheduler(backend).run(timeline)
+    assert len(report.errors) == len(timeline.events)
+    assert min(report.errors) >= 0.0
+    assert report.achieved >= report.planned
+    sent = [t for t, _, _ in backend.calls]
+    assert sent == sorted(sent)
+    for t, event in zip(sent, timeline.events):
+        assert t - start - event.t > -CLOCK_SLACK
+
+
+def test_run_async_never_sends_events_early():
+    backend = NullInputBackend()
+    timeline = compile_write("timeline", 0.02)
+    report = asyncio.run(TimelineScheduler(backend).run_async(timeline))
+    assert [args for _, _, args in backend.calls] == [(c,) for c in "timeline"]
+    # the event loop runs timers that are due within its clock's resolution
+    early = time.get_clock_info("monotonic").resolution + CLOCK_SLACK
+    assert min(report.errors) > -early
+    assert report.achieved > report.planned - early
+
+
+@pytest.mark.timing
+def test_run_keeps_events_on_their_planned_time():
+    backend = NullInputBackend()
+    # many short steps, sleeping once per step would let the timer granularity add up over them
+    timeline = compile_move([(0, 0), (300, 0)], 0.2, step_rate=250)
+    start = time.perf_counter()
+    report = TimelineScheduler(backend).run(timeline)
+    assert report.max_error < MAX_EVENT_ERROR
+    assert abs(report.achieved - report.planned) < MAX_EVENT_ERROR
+    for (sent, _, _), event in zip(backend.calls, timeline.events):
+        assert sent - start - event.t < MAX_EVENT_ERROR
+
+
+@pytest.mark.timing
+def test_run_async_keeps_events_on_their_planned_time():
+    backend = NullInputBackend()
+    timeline = compile_write("timeline", 0.02)
+    report = asyncio.run(TimelineScheduler(backend).run_async(timeline))
+    assert report.max_error < MAX_ASYNC_EVENT_ERROR
+    assert abs(report.achieved - report.planned) < MAX_ASYNC_EVENT_ERROR
+
+
+def test_empty_timeline():
+    report = TimelineScheduler(NullInputBackend()).run(Timeline())
+    assert report.planned == 0.0 and report.errors == []
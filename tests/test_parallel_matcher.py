@@ -0,0 +1,26 @@
+import numpy as np
+
+import parallel_matcher
+from parallel_matcher import SharedFrameRing, _attach
+
+
+def test_workers_let_go_of_buffers_the_ring_replaced(monkeypatch):
+    monkeypatch.setattr(parallel_matcher, "_attached", {})
+    ring = SharedFrameRing(size=2)
+    try:
+        small = np.arange(12, dtype=np.uint8).reshape(3, 4)
+        specs = [ring.put(small), ring.put(small)]
+        for spec in specs:
+            assert np.array_equal(_attach(*spec), small)
+        assert set(parallel_matcher._attached) == {spec[0] for spec in specs}
+
+        # a larger frame replaces both buffers, the next attach closes the handles to the unlinked ones
+        large = np.ones((6, 8), dtype=np.uint8)
+        spec = ring.put(large)
+        assert spec[3] == specs[0][3] + 1
+        assert np.array_equal(_attach(*spec), large)
+        assert set(parallel_matcher._attached) == {spec[0]}
+    finally:
+        for _, shm in parallel_matcher._attached.values():
+            shm.close()
+        ring.close()
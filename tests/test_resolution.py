@@ -0,0 +1,68 @@
+import os
+import cv2
+import numpy as np
+import pytest
+
+import resolution
+import template_finder
+from config import Config
+from template_finder import TemplateRegistry, _process_template_refs, _feature_match
+
+ROIS = {"panel": [100, 50, 200, 100], "corner": [1180, 620, 100, 100]}
+
+
+@pytest.fixture
+def rois(monkeypatch):
+    monkeypatch.setattr(Config, "ui_roi", ROIS)
+
+
+def test_scale_roi():
+    assert resolution.scale_roi([100, 50, 200, 100], 1.0) == [100, 50, 200, 100]
+    assert resolution.scale_roi([100, 50, 200, 100], 0.8, (0, 96)) == [80, 136, 160, 80]
+    # neighbouring rois keep sharing their edge after rounding
+    left, right = resolution.scale_roi([0, 0, 3, 3], 0.75), resolution.scale_roi([3, 0, 3, 3], 0.75)
+    assert left[0] + left[2] == right[0]
+
+
+def test_narrower_window_is_letterboxed_at_top_and_bottom(rois):
+    resolution.set_client_size(1024, 768)
+    assert resolution.current_scale() == 0.8
+    assert resolution.ui_offset() == (0, 96)
+    assert resolution.frame_size() == (1024, 768)
+    assert resolution.roi_table() == {"panel": [80, 136, 160, 80], "corner": [944, 592, 80, 80]}
+
+
+def test_taller_window_at_full_scale_is_only_shifted(rois):
+    resolution.set_client_size(1280, 800)
+    assert resolution.current_scale() == 1.0
+    assert resolution.ui_offset() == (0, 40)
+    assert resolution.roi_table() == {"panel": [100, 90, 200, 100], "corner": [1180, 660, 100, 100]}
+
+
+def test_roi_table_follows_a_replaced_ui_roi(rois, monkeypatch):
+    resolution.set_client_size(1024, 768)
+    assert resolution.roi_table()["panel"] == [80, 136, 160, 80]
+    monkeypatch.setattr(Config, "ui_roi", {"panel": [0, 0, 100, 100]})
+    assert resolution.roi_table() == {"panel": [0, 96, 80, 80]}
+
+
+def test_feature_match_at_a_smaller_ui_scale(tmp_path, monkeypatch, window_at_origin):
+    # blocks instead of per-pixel noise, so the texture and its keypoints survive the resize
+    blocks = np.random.default_rng(0).integers(0, 255, (12, 16, 3), dtype=np.uint8)
+    stamp = cv2.resize(blocks, (160, 120), interpolation=cv2.INTER_NEAREST)
+    cv2.imwrite(os.path.join(tmp_path, "stamp.png"), stamp)
+    registry = TemplateRegistry([str(tmp_path)], 1 << 22, os.path.join(tmp_path, "templates.store"))
+    monkeypatch.setattr(template_finder, "stored_templates", lambda: registry)
+
+    resolution.set_client_size(960, 540)
+    assert resolution.current_scale() == 0.75
+    template = _process_template_refs("STAMP", use_features=True)[0]
+    assert template.scale == 0.75
+    frame = np.zeros((540, 960, 3), dtype=np.uint8)
+    frame[200:290, 300:420] = resolution.scale_image(stamp, 0.75)
+
+    match = _feature_match(template, frame, [200, 100, 500, 300])
+    assert match.score > 0.9
+    x, y, w, h = match.region
+    assert abs(x - 300) <= 1 and abs(y - 200) <= 1
+    assert (w, h) == (120, 90)
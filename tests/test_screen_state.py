@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+import resolution
+from config import Config
+from ui_control import ScreenObject, ScreenObjects
+from screen_state import ScreenState
+
+FRAME_SHAPE = (720, 1280, 3)
+ROIS = {
+    "panel": [100, 100, 200, 150],
+    "panel_button": [120, 120, 100, 60],
+    "corner": [1000, 600, 200, 100],
+}
+
+
+def _stamp(seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 255, (20, 30, 3), dtype=np.uint8)
+
+
+PANEL, BUTTON, CORNER = _stamp(1), _stamp(2), _stamp(3)
+
+
+def _screen_object(monkeypatch, key: str, stamp: np.ndarray, roi_name: str, parents: list[str] = None) -> ScreenObject:
+    screen_object = ScreenObject(name=[stamp], roi_name=roi_name, threshold=0.9, parents=parents)
+    screen_object.key = key
+    # parents are looked up by name in ScreenObjects
+    monkeypatch.setattr(ScreenObjects, key, screen_object, raising=False)
+    return screen_object
+
+
+@pytest.fixture
+def objects(monkeypatch, window_at_origin):
+    monkeypatch.setattr(Config, "ui_roi", ROIS)
+    return [
+        _screen_object(monkeypatch, "TestButton", BUTTON, "panel_button", parents=["TestPanel"]),
+        _screen_object(monkeypatch, "TestCorner", CORNER, "corner"),
+        _screen_object(monkeypatch, "TestPanel", PANEL, "panel"),
+    ]
+
+
+def _frame(*placed: tuple[np.ndarray, int, int]) -> np.ndarray:
+    frame = np.zeros(FRAME_SHAPE, dtype=np.uint8)
+    for stamp, x, y in placed:
+        frame[y:y + stamp.shape[0], x:x + stamp.shape[1]] = stamp
+    return frame
+
+
+def test_plan_checks_parents_first_and_merges_overlapping_rois(objects):
+    state = ScreenState(objects)
+    order = [check.screen_object.key for check in state.plan]
+    assert order.index("TestPanel") < order.index("TestButton")
+    group_of = {check.screen_object.key: check.group for check in state.plan}
+    assert group_of["TestPanel"] is group_of["TestButton"]
+    assert group_of["TestCorner"] is not group_of["TestPanel"]
+    assert group_of["TestPanel"].roi == ROIS["panel"]
+
+
+def test_classify_finds_all_visible_objects(objects):
+    frame = _frame((PANEL, 250, 200), (BUTTON, 150, 140), (CORNER, 1100, 650))
+    visible = ScreenState(objects).classify(frame)
+    assert set(visible) == {"TestPanel", "TestButton", "TestCorner"}
+    assert visible["TestButton"].region == [150, 140, 30, 20]
+
+
+def test_detect_only_checks_children_of_visible_parents(objects):
+    state = ScreenState(objects, resync_frames=3)
+    orphan = _frame((BUTTON, 150, 140))
+    # the first pass checks everything, the button is seen without its panel
+    assert set(state.detect(orphan)) == {"TestButton"}
+    # afterwards the button is only checked while its panel is visible
+    assert state.detect(orphan) == {}
+    assert state.detect(orphan) == {}
+    assert set(state.detect(_frame((PANEL, 250, 200), (BUTTON, 150, 140)))) == {"TestPanel", "TestButton"}
+    # the panel was visible in the previous frame, so the button is still checked
+    assert set(state.detect(orphan)) == {"TestButton"}
+
+
+def test_detect_resyncs_every_resync_frames(objects):
+    state = ScreenState(objects, resync_frames=2)
+    orphan = _frame((BUTTON, 150, 140))
+    results = [set(state.detect(orphan)) for _ in range(6)]
+    assert results == [{"TestButton"}, set(), set(), {"TestButton"}, set(), set()]
+
+
+def test_plan_is_rebuilt_when_the_layout_changes(objects):
+    state = ScreenState(objects)
+    rois = {check.screen_object.key: check.roi for check in state.plan}
+    assert state.frame_size == (1280, 720)
+
+    resolution.set_client_size(1024, 768)
+    small = _frame()[:768, :1024]
+    state.classify(small)
+    assert state.frame_size == (1024, 768)
+    scaled = {check.screen_object.key: check.roi for check in state.plan}
+    assert scaled["TestPanel"] == resolution.scale_roi(rois["TestPanel"], 0.8, resolution.ui_offset())
+    assert scaled["TestPanel"] != rois["TestPanel"]
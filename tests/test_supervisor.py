@@ -0,0 +1,26 @@
+import time
+import heapq
+
+from supervisor import CaptureScheduler
+
+
+def test_captured_reschedules_the_window_that_was_captured():
+    scheduler = CaptureScheduler(fps_budget=10)
+    scheduler.set_windows([1])
+    hwnd, _ = scheduler.next_due()
+    # a window added before the capture of 1 finished is due right away and ends up on top of the heap
+    scheduler.set_windows([1, 2])
+    scheduler._due = [(time.perf_counter() - 1, 2) if h == 2 else (t, h) for t, h in scheduler._due]
+    heapq.heapify(scheduler._due)
+    scheduler.captured(hwnd)
+    assert scheduler.next_due() == (2, 0.0)
+    due = dict((h, t) for t, h in scheduler._due)
+    assert due[1] > time.perf_counter()
+
+
+def test_captured_ignores_windows_that_were_removed():
+    scheduler = CaptureScheduler(fps_budget=10)
+    scheduler.set_windows([1, 2])
+    scheduler.set_windows([2])
+    scheduler.captured(1)
+    assert [h for _, h in scheduler._due] == [2]
@@ -0,0 +1,48 @@
+import os
+import threading
+import cv2
+import numpy as np
+
+from template_finder import TemplateRegistry
+
+
+def _registry(tmp_path, budget: int = 1 << 20) -> TemplateRegistry:
+    rng = np.random.default_rng(0)
+    for name in ("a", "b", "c"):
+        cv2.imwrite(os.path.join(tmp_path, f"{name}.png"), rng.integers(0, 255, (40, 60, 3), dtype=np.uint8))
+    return TemplateRegistry([str(tmp_path)], budget, os.path.join(tmp_path, "templates.store"))
+
+
+def test_unscaled_variants_are_store_views_and_not_counted(tmp_path):
+    registry = _registry(tmp_path)
+    img = registry.variant("A", "img_bgr")
+    assert img.shape == (40, 60, 3)
+    assert not img.flags.owndata
+    assert registry.memory_usage() == 0
+
+
+def test_scaled_variants_are_counted_and_evicted(tmp_path):
+    # room for two 30x20 bgr variants
+    registry = _registry(tmp_path, budget=2 * 30 * 20 * 3)
+    for key in ("A", "B", "C"):
+        assert registry.variant(key, "img_bgr", 0.5).shape == (20, 30, 3)
+    assert registry.memory_usage() == 2 * 30 * 20 * 3
+    assert registry.variant("C", "img_bgr", 0.5) is registry.variant("C", "img_bgr", 0.5)
+
+
+def test_concurrent_misses_count_a_variant_once(tmp_path):
+    registry = _registry(tmp_path)
+    barrier = threading.Barrier(8)
+    results = []
+
+    def load():
+        barrier.wait()
+        results.append(registry.variant("A", "img_gray", 0.75))
+
+    threads = [threading.Thread(target=load) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert registry.memory_usage() == results[0].nbytes
+    assert all(r is results[0] for r in results)
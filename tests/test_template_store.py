@@ -0,0 +1,51 @@
+import os
+import cv2
+import numpy as np
+
+from template_store import build_store, open_store, _read_index
+
+
+def _write_template(folder, name: str):
+    rng = np.random.default_rng(len(name))
+    cv2.imwrite(os.path.join(folder, f"{name}.png"), rng.integers(0, 255, (24, 32, 4), dtype=np.uint8))
+
+
+def _blobs(store_path: str) -> set[str]:
+    folder, prefix = os.path.split(store_path)
+    return {f for f in os.listdir(folder) if f.startswith(prefix + ".") and f[len(prefix) + 1:].isdigit()}
+
+
+def test_build_keeps_blobs_of_newer_builds(tmp_path):
+    folder = str(tmp_path)
+    _write_template(folder, "a")
+    store_path = os.path.join(folder, "templates.store")
+    first = build_store([folder], store_path)["blob"]
+    # a concurrent build that finished later
+    newer = f"templates.store.{int(first.rsplit('.', 1)[1]) + 10 ** 15}"
+    open(os.path.join(folder, newer), "wb").close()
+    second = build_store([folder], store_path)["blob"]
+    assert _blobs(store_path) == {second, newer}
+
+
+def test_open_store_survives_a_removed_blob(tmp_path):
+    folder = str(tmp_path)
+    _write_template(folder, "a")
+    store_path = os.path.join(folder, "templates.store")
+    build_store([folder], store_path)
+    os.remove(os.path.join(folder, _read_index(store_path)["blob"]))
+    store = open_store([folder], store_path)
+    assert store.variant("A", "img_bgr").shape == (24, 32, 3)
+
+
+def test_touched_sources_update_the_index_without_rebuilding(tmp_path):
+    folder = str(tmp_path)
+    _write_template(folder, "a")
+    store_path = os.path.join(folder, "templates.store")
+    blob = build_store([folder], store_path)["blob"]
+    path = os.path.join(folder, "a.png")
+    os.utime(path, (1, 1))
+    open_store([folder], store_path)
+    index = _read_index(store_path)
+    assert index["blob"] == blob
+    assert index["sources"][path]["mtime"] == 1
+    assert not [f for f in os.listdir(folder) if f.endswith(".tmp")]
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from loguru import logger
+
+from config import Config
+from ui_control import ScreenObject
+import template_finder
+from template_finder import track_screen_object, reset_tracking, _tracks
+
+FRAME_SHAPE = (720, 1280, 3)
+ROIS = {"field": [100, 100, 800, 500]}
+
+
+def _stamp(seed: int, shape: tuple[int, int]) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 255, (*shape, 3), dtype=np.uint8)
+
+
+SMALL, LARGE = _stamp(1, (20, 30)), _stamp(2, (60, 90))
+
+
+def _frame(stamp: np.ndarray, x: int, y: int) -> np.ndarray:
+    frame = np.zeros(FRAME_SHAPE, dtype=np.uint8)
+    frame[y:y + stamp.shape[0], x:x + stamp.shape[1]] = stamp
+    return frame
+
+
+@pytest.fixture
+def corpse(monkeypatch, window_at_origin):
+    monkeypatch.setattr(Config, "ui_roi", ROIS)
+    screen_object = ScreenObject(name=[SMALL, LARGE], roi_name="field", threshold=0.9)
+    screen_object.key = "TestCorpse"
+    yield screen_object
+    reset_tracking()
+
+
+@pytest.fixture
+def errors():
+    messages = []
+    handler = logger.add(messages.append, level="ERROR")
+    yield messages
+    logger.remove(handler)
+
+
+def test_windows_fit_the_largest_template(corpse, errors):
+    assert track_screen_object(corpse, _frame(SMALL, 400, 300)).valid
+    # the window around the small match must still have room for the large template
+    match = track_screen_object(corpse, _frame(LARGE, 380, 280))
+    assert match.valid and match.region == [380, 280, 90, 60]
+    assert errors == []
+    assert _tracks[id(corpse)].misses == 0
+
+
+def test_windows_near_the_roi_border_are_shifted_inside(corpse, errors, monkeypatch):
+    assert track_screen_object(corpse, _frame(SMALL, 100, 100)).valid
+    searched = []
+    detect = template_finder._detect_in_roi
+
+    def record(screen_object, inp_img, roi, use_pyramid):
+        searched.append(roi)
+        return detect(screen_object, inp_img, roi, use_pyramid)
+
+    monkeypatch.setattr(template_finder, "_detect_in_roi", record)
+    assert track_screen_object(corpse, _frame(SMALL, 104, 102)).valid
+    margin = template_finder.TRACKING_MARGIN
+    assert searched == [[100, 100, 90 + 2 * margin, 60 + 2 * margin]]
+    assert errors == []
+
+
+def test_object_that_left_the_window_is_found_in_the_roi(corpse):
+    assert track_screen_object(corpse, _frame(SMALL, 150, 150)).valid
+    match = track_screen_object(corpse, _frame(SMALL, 800, 500))
+    assert match.valid and match.region[:2] == [800, 500]
+    assert _tracks[id(corpse)].misses == 1
+    assert not track_screen_object(corpse, _frame(SMALL, 0, 0)).valid
+    assert id(corpse) not in _tracks
@@ -0,0 +1,33 @@
+import pytest
+
+import resolution
+from config import Config
+from ui_control import ScreenObject, ScreenObjects
+from template_finder import _resolve_roi
+from screen_state import ScreenState
+
+SCREEN_OBJECTS = {key: o for key, o in vars(ScreenObjects).items() if isinstance(o, ScreenObject)}
+
+
+@pytest.mark.parametrize("key", sorted(SCREEN_OBJECTS))
+def test_every_screen_object_roi_resolves(key):
+    screen_object = SCREEN_OBJECTS[key]
+    roi = _resolve_roi(screen_object)
+    if screen_object.roi_name in Config.ui_roi:
+        width, height = resolution.frame_size()
+        x, y, w, h = roi
+        assert 0 <= x and 0 <= y and w > 0 and h > 0 and x + w <= width and y + h <= height
+    else:
+        # no roi, or one missing from Config.ui_roi: the whole frame is searched
+        assert roi is None
+
+
+def test_missing_roi_falls_back_to_the_whole_frame(monkeypatch):
+    monkeypatch.setattr(Config, "ui_roi", {"gold_btn": [10, 20, 30, 40]})
+    assert _resolve_roi(ScreenObjects.GoldBtnInventory) == [10, 20, 30, 40]
+    assert _resolve_roi(ScreenObjects.InGame) is None
+
+
+def test_screen_state_compiles_all_screen_objects():
+    state = ScreenState()
+    assert len(state.plan) == len(SCREEN_OBJECTS)
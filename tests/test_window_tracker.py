@@ -0,0 +1,96 @@
+import pytest
+
+from config import Config
+import window_tracker
+from window_tracker import WindowTracker, FakeWindowApi
+
+GAME = "D2R.exe"
+
+
+@pytest.fixture
+def api():
+    api = FakeWindowApi()
+    api.add_window(1, 100, "explorer.exe")
+    api.add_window(2, 200, "chrome.exe")
+    api.add_window(3, 200, "chrome.exe")
+    return api
+
+
+def test_find_windows_matches_the_process_name(api):
+    api.add_window(4, 300, GAME)
+    api.add_window(5, 301, GAME)
+    assert WindowTracker(api, GAME).find_windows() == [4, 5]
+    assert WindowTracker(api, GAME).find_windows(first_only=True) == [4]
+
+
+def test_process_names_are_asked_once_per_pid(api):
+    tracker = WindowTracker(api, GAME)
+    for _ in range(5):
+        assert tracker.find_windows() == []
+    # two processes own the three windows, every later pass is answered from the cache
+    assert api.calls["process_name"] == 2
+    api.add_window(6, 300, GAME)
+    assert tracker.find_windows() == [6]
+    assert api.calls["process_name"] == 3
+
+
+def test_pid_cache_forgets_processes_without_windows(api):
+    tracker = WindowTracker(api, GAME)
+    tracker.find_windows()
+    api.remove_window(1)
+    tracker.find_windows()
+    assert set(tracker.pid_names) == {200}
+    # a reused pid is asked again
+    api.add_window(7, 100, GAME)
+    assert tracker.find_windows() == [7]
+
+
+def test_discovery_backs_off_while_no_window_is_found(api):
+    tracker = WindowTracker(api, GAME)
+    delays = [tracker.poll() for _ in range(8)]
+    expected = [min(Config.game['discovery_min_interval'] * 2 ** i, Config.game['discovery_max_interval'])
+                for i in range(8)]
+    assert delays == expected
+    tracker.wake()
+    assert tracker.poll() == Config.game['discovery_min_interval']
+
+
+def test_found_window_is_tracked_and_published(api):
+    changes = []
+    tracker = WindowTracker(api, GAME, on_change=lambda hwnd, rect: changes.append((hwnd, rect)))
+    tracker.poll()
+    tracker.poll()
+    api.add_window(8, 400, GAME, (10, 20, 1280, 720))
+    assert tracker.poll() == Config.game['window_track_interval']
+    assert tracker.window == (8, (10, 20, 1280, 720))
+    # the backoff starts over once the window is found
+    assert tracker.interval == Config.game['discovery_min_interval']
+
+    list_calls = api.calls["list_windows"]
+    tracker.poll()
+    api.move_window(8, (30, 40))
+    tracker.poll()
+    # a known window is only followed, not searched for again
+    assert api.calls["list_windows"] == list_calls
+    assert changes == [(8, (10, 20, 1280, 720)), (8, (30, 40, 1280, 720))]
+
+
+def test_lost_window_is_reported_and_searched_again(api):
+    changes = []
+    api.add_window(8, 400, GAME)
+    tracker = WindowTracker(api, GAME, on_change=lambda hwnd, rect: changes.append((hwnd, rect)))
+    tracker.poll()
+    api.remove_window(8)
+    assert tracker.poll() == Config.game['discovery_min_interval']
+    assert tracker.window is None
+    assert changes[-1] == (None, None)
+    api.add_window(9, 401, GAME)
+    tracker.poll()
+    assert tracker.window[0] == 9
+
+
+def test_without_window_api_nothing_is_found(monkeypatch):
+    # as on hosts without pywin32
+    monkeypatch.setattr(window_tracker, "default_window_api", lambda: None)
+    tracker = WindowTracker(api=None, process_name=GAME)
+    assert tracker.find_windows() == []